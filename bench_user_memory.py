@@ -0,0 +1,90 @@
+"""
+قياس ذاكرة سجلات المستخدمين: القواميس القديمة مقابل السجلات المضغوطة
+
+الاستخدام: python bench_user_memory.py [عدد المستخدمين]
+"""
+
+import gc
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from user_store import UserRecord
+
+FIRST_NAMES = ["أحمد", "محمد", "علي", "فاطمة", "سارة", "Omar", "John", "Maria", "Yusuf", "Layla"]
+
+def read_rss() -> int:
+    """الذاكرة المقيمة الحالية بالبايت (لينكس)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * 4096
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def build_legacy(count: int) -> dict:
+    """الصيغة القديمة: قاموس لكل مستخدم بمفتاح نصي وطوابع ISO"""
+    users = {}
+    now = time.time()
+    for user_id in range(100000000, 100000000 + count):
+        users[str(user_id)] = {
+            'user_id': user_id,
+            'username': f"user{user_id}",
+            'first_name': FIRST_NAMES[user_id % len(FIRST_NAMES)],
+            'join_date': datetime.fromtimestamp(now - user_id % 86400).isoformat(),
+            'last_interaction': datetime.fromtimestamp(now).isoformat(),
+            'message_count': user_id % 50,
+            'is_active': True
+        }
+    return users
+
+def build_compact(count: int) -> dict:
+    """الصيغة الجديدة: سجلات بخانات ثابتة بمفتاح صحيح وطوابع صحيحة"""
+    users = {}
+    now = int(time.time())
+    for user_id in range(100000000, 100000000 + count):
+        users[user_id] = UserRecord(
+            user_id, f"user{user_id}", FIRST_NAMES[user_id % len(FIRST_NAMES)],
+            now - user_id % 86400, now, user_id % 50
+        )
+    return users
+
+BUILDERS = {
+    'legacy': ("dict (قديم)", build_legacy),
+    'compact': ("UserRecord (مضغوط)", build_compact),
+}
+
+def measure(mode: str, count: int):
+    """القياس في عملية مستقلة حتى لا تؤثر ذاكرة قياس على الآخر"""
+    name, builder = BUILDERS[mode]
+    
+    # الذاكرة المقيمة دون tracemalloc لأن تتبعه يضاعفها
+    gc.collect()
+    rss_before = read_rss()
+    users = builder(count)
+    rss = read_rss() - rss_before
+    del users
+    gc.collect()
+    
+    tracemalloc.start()
+    users = builder(count)
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    mb = 1024 * 1024
+    print(f"{name:<22} tracemalloc: {traced / mb:8.1f} MB | RSS: {rss / mb:8.1f} MB | "
+          f"{traced / count:6.0f} بايت/مستخدم")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    if len(sys.argv) > 2:
+        measure(sys.argv[2], count)
+        return
+    
+    print(f"👥 عدد المستخدمين: {count}")
+    for mode in BUILDERS:
+        subprocess.run([sys.executable, __file__, str(count), mode], check=True)
+
+if __name__ == "__main__":
+    main()
@@ -3,92 +3,173 @@
 """
 
 import logging
-import json
-import os
 import asyncio
+import contextlib
+import time
 from datetime import datetime
-from typing import Dict, List, Optional
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from telegram import Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 from config import Config
+from user_store import PendingUpdate, UserStore, create_user_store
+from user_stats import ActivityRollups
+from request_control import GeminiError
+from broadcast import UNREACHABLE, BroadcastEngine, BroadcastJob, BroadcastJobStore, retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
 class UserManager:
-    """إدارة المستخدمين"""
+    """إدارة المستخدمين - تخزين مؤجل مع دمج التحديثات فوق مخزن قابل للاستبدال"""
     
-    def __init__(self, users_file: str = "users.json"):
-        self.users_file = users_file
-        self.users_data = self.load_users()
+    def __init__(self, store: UserStore = None, flush_interval: float = 5.0, max_pending: int = 100,
+                 rollups: ActivityRollups = None):
+        self.store = store or create_user_store()
+        self.flush_interval = flush_interval  # ثوانٍ بين كل حفظ
+        self.max_pending = max_pending  # عدد المستخدمين المعلقين الذي يستدعي حفظاً مبكراً
+        self.pending: Dict[int, PendingUpdate] = {}
+        self.pending_inactive = set()  # مستخدمون لا يمكن الوصول إليهم بانتظار الحفظ
+        self.rollups = rollups or ActivityRollups()
+        
+        # إجماليات تراكمية تُحسب مرة واحدة عند البدء ثم تُحدّث مع كل تفاعل
+        totals = self.store.get_totals()
+        self.total_users = totals['total_users']
+        self.active_users = totals['active_users']
+        self.total_messages = totals['total_messages']
+        self._flush_event = None
+        self._flush_lock = None
+        self._flush_task = None
     
-    def load_users(self) -> Dict:
-        """تحميل بيانات المستخدمين"""
-        try:
-            if os.path.exists(self.users_file):
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return {}
-        except Exception as e:
-            logger.error(f"خطأ في تحميل المستخدمين: {e}")
-            return {}
+    async def start(self):
+        """تشغيل مهمة الحفظ الدوري في الخلفية"""
+        self._flush_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = asyncio.create_task(self._flush_loop())
     
-    def save_users(self) -> bool:
-        """حفظ بيانات المستخدمين"""
-        try:
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users_data, f, ensure_ascii=False, indent=2)
+    async def _flush_loop(self):
+        """الحفظ كل فترة أو عند تراكم التحديثات"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.save_users()
+    
+    def _write_batch(self, updates: List[PendingUpdate], inactive: List[int]):
+        """كتابة الدفعة في المخزن - تعمل في خيط منفصل"""
+        # التعطيل أولاً، فإن تفاعل المستخدم في نفس الفترة يعيد تنشيطه
+        deactivated = self.store.set_inactive(inactive) if inactive else 0
+        result = self.store.apply_updates(updates) if updates else {'new_users': [], 'reactivated': 0}
+        return result, deactivated
+    
+    async def save_users(self) -> bool:
+        """حفظ التحديثات المعلقة في المخزن دون حجز حلقة الأحداث"""
+        if not self.pending and not self.pending_inactive:
             return True
-        except Exception as e:
-            logger.error(f"خطأ في حفظ المستخدمين: {e}")
-            return False
+        
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        
+        async with self._flush_lock:
+            batch, self.pending = self.pending, {}
+            inactive, self.pending_inactive = self.pending_inactive, set()
+            if not batch and not inactive:
+                return True
+            try:
+                result, deactivated = await asyncio.to_thread(
+                    self._write_batch, list(batch.values()), sorted(inactive)
+                )
+            except Exception as e:
+                logger.error(f"خطأ في حفظ المستخدمين: {e}")
+                # إعادة الدفعة مع دمج ما وصل بعدها حتى لا يضيع أي تحديث
+                for user_id, update in self.pending.items():
+                    if user_id in batch:
+                        batch[user_id].absorb(update)
+                    else:
+                        batch[user_id] = update
+                self.pending = batch
+                self.pending_inactive |= inactive
+                return False
+            
+            new_users = result['new_users']
+            for user_id in new_users:
+                logger.info(f"مستخدم جديد: {user_id} - {batch[user_id].first_name}")
+            self.total_users += len(new_users)
+            self.active_users += len(new_users) + result['reactivated'] - deactivated
+            self.rollups.record_new_users(len(new_users))
+            
+            # داخل القفل حتى لا يتداخل حفظان ولا تحل نسخة أقدم محل أحدث
+            await asyncio.to_thread(self.rollups.save, self.rollups.snapshot())
+        return True
     
     def add_user(self, user_id: int, username: str = None, first_name: str = None) -> bool:
-        """إضافة مستخدم جديد"""
+        """تسجيل تفاعل مستخدم في الذاكرة - يُحفظ لاحقاً مع دفعته"""
         try:
-            user_id_str = str(user_id)
-            if user_id_str not in self.users_data:
-                self.users_data[user_id_str] = {
-                    'user_id': user_id,
-                    'username': username,
-                    'first_name': first_name,
-                    'join_date': datetime.now().isoformat(),
-                    'last_interaction': datetime.now().isoformat(),
-                    'message_count': 1,
-                    'is_active': True
-                }
-                logger.info(f"مستخدم جديد: {user_id} - {first_name}")
+            timestamp = datetime.now().isoformat()
+            self.total_messages += 1
+            self.rollups.record_message(user_id)
+            
+            update = self.pending.get(user_id)
+            if update is None:
+                self.pending[user_id] = PendingUpdate(user_id, username, first_name, timestamp)
+                if len(self.pending) >= self.max_pending and self._flush_event is not None:
+                    self._flush_event.set()
             else:
-                # تحديث آخر تفاعل
-                self.users_data[user_id_str]['last_interaction'] = datetime.now().isoformat()
-                self.users_data[user_id_str]['message_count'] += 1
-                if username:
-                    self.users_data[user_id_str]['username'] = username
-                if first_name:
-                    self.users_data[user_id_str]['first_name'] = first_name
-            
-            return self.save_users()
+                update.merge(username, first_name, timestamp)
+            return True
         except Exception as e:
             logger.error(f"خطأ في إضافة المستخدم: {e}")
             return False
     
-    def get_user_count(self) -> int:
+    def mark_inactive(self, user_id: int):
+        """تعليم مستخدم لا يمكن الوصول إليه (حظر البوت أو حذف الحساب) - يُحفظ مع الدفعة التالية"""
+        self.pending_inactive.add(user_id)
+    
+    def get_user_count(self, active_only: bool = False) -> int:
         """الحصول على عدد المستخدمين"""
-        return len(self.users_data)
+        return self.store.count_users(active_only)
+    
+    def iter_users(self, after_id: int = None, active_only: bool = False) -> Iterator[Dict]:
+        """المرور على المستخدمين دون تحميلهم كلهم في الذاكرة"""
+        return self.store.iter_users(after_id=after_id, active_only=active_only)
+    
+    def get_user_ids(self, after_id: int = None, limit: int = 1000, active_only: bool = False) -> List[int]:
+        """صفحة من معرفات المستخدمين بعد after_id - تُستدعى من خيط منفصل"""
+        return self.store.get_user_ids(after_id=after_id, limit=limit, active_only=active_only)
     
     def get_all_users(self) -> List[Dict]:
         """الحصول على جميع المستخدمين"""
-        return list(self.users_data.values())
+        return list(self.store.iter_users())
     
     def get_stats(self) -> Dict:
-        """الحصول على إحصائيات المستخدمين"""
-        all_users = self.get_all_users()
-        total_messages = sum(user.get('message_count', 0) for user in all_users)
-        
+        """الحصول على إحصائيات المستخدمين من العدادات التراكمية - O(1)"""
+        return {
+            'total_users': self.total_users,
+            'active_users': self.active_users,
+            'total_messages': self.total_messages,
+            'avg_messages_per_user': round(self.total_messages / self.total_users, 2) if self.total_users else 0,
+            'today': self.rollups.daily.series(1)[0]
+        }
+    
+    def get_trends(self, hours: int = 24, days: int = 7) -> Dict:
+        """سلاسل النشاط لكل ساعة ولكل يوم"""
         return {
-            'total_users': len(all_users),
-            'total_messages': total_messages,
-            'avg_messages_per_user': round(total_messages / len(all_users), 2) if all_users else 0
+            'hourly': self.rollups.hourly.series(hours),
+            'daily': self.rollups.daily.series(days)
         }
+    
+    async def close(self):
+        """إيقاف الحفظ الدوري وحفظ المتبقي ثم إغلاق المخزن"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.save_users()
+        await asyncio.to_thread(self.store.close)
 
 class BotHandlers:
     """معالجات البوت - محسن"""
@@ -97,9 +178,35 @@ class BotHandlers:
         self.config = Config()
         self.gemini_handler = gemini_handler
         self.voice_handler = voice_handler
-        self.user_manager = UserManager()
+        self.user_manager = UserManager(
+            create_user_store(self.config.USER_STORE_BACKEND, self.config.USER_STORE_PATH or None),
+            flush_interval=self.config.USER_STORE_FLUSH_INTERVAL,
+            max_pending=self.config.USER_STORE_BATCH_SIZE,
+            rollups=ActivityRollups(self.config.STATS_FILE)
+        )
+        self.broadcast_engine = BroadcastEngine(
+            lambda after_id, limit: self.user_manager.get_user_ids(after_id, limit, active_only=True),
+            job_store=BroadcastJobStore(self.config.BROADCAST_JOBS_FILE),
+            rate=self.config.BROADCAST_RATE,
+            concurrency=self.config.BROADCAST_CONCURRENCY,
+            progress_interval=self.config.BROADCAST_PROGRESS_INTERVAL,
+            checkpoint_every=self.config.BROADCAST_CHECKPOINT_EVERY,
+            on_progress=self.update_broadcast_progress,
+            on_unreachable=self.user_manager.mark_inactive
+        )
         self.user_states = {}  # لتتبع حالة المستخدمين
     
+    async def startup(self, application):
+        """تشغيل المهام الخلفية بعد بدء التطبيق"""
+        await self.user_manager.start()
+        self.broadcast_engine.resume_jobs(application.bot)
+    
+    async def shutdown(self):
+        """حفظ البيانات المعلقة عند إيقاف البوت"""
+        await self.broadcast_engine.shutdown()
+        await self.user_manager.close()
+        self.gemini_handler.close()
+    
     async def handle_error(self, update: Update, context: ContextTypes.DEFAULT_TYPE, error: Exception, operation: str):
         """معالج الأخطاء المركزي"""
         try:
@@ -112,6 +219,9 @@ class BotHandlers:
                 "size": "❌ الملف كبير جداً. يرجى استخدام ملف أصغر.",
                 "format": "❌ تنسيق الملف غير مدعوم.",
                 "processing": "❌ حدث خطأ في المعالجة. يرجى المحاولة مرة أخرى.",
+                "busy": "⏳ البوت مشغول حالياً بسبب كثرة الطلبات. يرجى المحاولة بعد قليل.",
+                "unavailable": "🔧 خدمة الذكاء الاصطناعي غير متاحة مؤقتاً. يرجى المحاولة بعد دقيقة.",
+                "too_long": "📏 النص طويل جداً. يرجى إرسال نص أقصر.",
                 "default": "❌ حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى."
             }
             
@@ -125,6 +235,13 @@ class BotHandlers:
         except Exception as e:
             logger.error(f"خطأ في معالج الأخطاء: {e}")
     
+    def format_trend(self, series: List[Dict], key: str) -> str:
+        """رسم مصغر لسلسلة نشاط"""
+        bars = "▁▂▃▄▅▆▇█"
+        values = [point[key] for point in series]
+        peak = max(values) or 1
+        return ''.join(bars[value * (len(bars) - 1) // peak] for value in values)
+    
     def reset_user_state(self, user_id: int):
         """إعادة تعيين حالة المستخدم"""
         if user_id in self.user_states:
@@ -182,6 +299,15 @@ class BotHandlers:
             logger.error(f"خطأ في معالج البدء: {e}")
             await update.message.reply_text("❌ حدث خطأ. يرجى المحاولة مرة أخرى.")
     
+    async def new_chat_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """معالج أمر المحادثة الجديدة"""
+        try:
+            self.gemini_handler.new_chat(update.effective_user.id)
+            self.reset_user_state(update.effective_user.id)
+            await update.message.reply_text("🧹 تم بدء محادثة جديدة. ما الذي تريد التحدث عنه؟")
+        except Exception as e:
+            logger.error(f"خطأ في بدء محادثة جديدة: {e}")
+    
     async def help_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج أمر المساعدة"""
         try:
@@ -190,6 +316,7 @@ class BotHandlers:
 
 🗣️ **للمحادثة العادية:**
 • اكتب أي سؤال أو رسالة وسأجيب عليها
+• أتذكر آخر رسائلك، استخدم /new لبدء محادثة جديدة
 
 📸 **لتحليل الصور:**
 • أرسل صورة مع أو بدون وصف
@@ -233,14 +360,25 @@ class BotHandlers:
         """معالج أمر الإحصائيات"""
         try:
             stats = self.user_manager.get_stats()
+            trends = self.user_manager.get_trends()
+            today = stats['today']
             
             stats_message = f"""
 📊 إحصائيات البوت:
 
 👥 إجمالي المستخدمين: {stats['total_users']}
+🔔 يستقبلون الرسائل: {stats['active_users']}
 💬 إجمالي الرسائل: {stats['total_messages']}
 📈 متوسط الرسائل لكل مستخدم: {stats['avg_messages_per_user']}
 
+📅 اليوم:
+• مستخدمون نشطون: {today['active_users']}
+• رسائل: {today['messages']}
+• مستخدمون جدد: {today['new_users']}
+
+📉 الرسائل آخر 24 ساعة: {self.format_trend(trends['hourly'], 'messages')}
+📉 النشطون آخر 7 أيام: {self.format_trend(trends['daily'], 'active_users')}
+
 ⏰ آخر تحديث: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
             """
             
@@ -250,11 +388,11 @@ class BotHandlers:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(stats_message, reply_markup=reply_markup)
+            await update.effective_message.reply_text(stats_message, reply_markup=reply_markup)
             
         except Exception as e:
             logger.error(f"خطأ في معالج الإحصائيات: {e}")
-            await update.message.reply_text("❌ حدث خطأ. يرجى المحاولة مرة أخرى.")
+            await update.effective_message.reply_text("❌ حدث خطأ. يرجى المحاولة مرة أخرى.")
     
     async def message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج الرسائل النصية - محسن"""
@@ -291,8 +429,15 @@ class BotHandlers:
             # إرسال رسالة "يكتب..."
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             
+            # بث الرد من Gemini وعرضه أثناء التوليد
+            if self.config.STREAM_RESPONSES:
+                await self.send_streamed_reply(
+                    update, self.gemini_handler.chat_response_stream(message_text, user.first_name, user.id)
+                )
+                return
+            
             # الحصول على رد من Gemini
-            response = await self.gemini_handler.chat_response(message_text, user.first_name)
+            response = await self.gemini_handler.chat_response(message_text, user.first_name, user.id)
             
             # تقسيم الرد إذا كان طويلاً
             if len(response) > self.config.MAX_MESSAGE_LENGTH:
@@ -305,10 +450,60 @@ class BotHandlers:
                 # إرسال الرد
                 await update.message.reply_text(response)
             
+        except GeminiError as e:
+            await self.handle_error(update, context, e, e.reason)
         except Exception as e:
             logger.error(f"خطأ في معالج الرسائل: {e}")
             await update.message.reply_text("❌ حدث خطأ. يرجى المحاولة مرة أخرى.")
     
+    async def show_partial(self, update: Update, message: Optional[Message], text: str, final: bool = False) -> Message:
+        """إرسال رسالة جديدة أو تعديل الرسالة الحالية بالنص الجزئي"""
+        if message is None:
+            return await update.message.reply_text(text)
+        try:
+            await message.edit_text(text)
+        except RetryAfter as e:
+            # التعديلات المرحلية يمكن تخطيها، أما النص النهائي فيجب أن يظهر
+            if final:
+                await asyncio.sleep(retry_after_seconds(e))
+                await message.edit_text(text)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+        return message
+    
+    async def send_streamed_reply(self, update: Update, chunks: AsyncIterator[str]):
+        """عرض رد متدفق في رسالة واحدة بتعديلات متباعدة، مع الانتقال لرسالة جديدة عند الحد الأقصى"""
+        limit = self.config.MAX_MESSAGE_LENGTH
+        interval = self.config.STREAM_EDIT_INTERVAL
+        message = None
+        text = ''
+        shown = ''
+        last_edit = 0.0
+        
+        # الإغلاق يحرر خانة القبول وبث Gemini حتى لو فشل تعديل الرسالة
+        async with contextlib.aclosing(chunks):
+            async for chunk in chunks:
+                text += chunk
+                
+                # إكمال الرسالة الحالية وبدء رسالة جديدة بالباقي
+                while len(text) > limit:
+                    head, text = text[:limit], text[limit:]
+                    await self.show_partial(update, message, head, final=True)
+                    message = None
+                    shown = ''
+                
+                now = time.monotonic()
+                if text.strip() and (message is None or now - last_edit >= interval):
+                    message = await self.show_partial(update, message, text)
+                    shown = text
+                    last_edit = now
+            
+        if text.strip() and text != shown:
+            await self.show_partial(update, message, text, final=True)
+        elif message is None and not text.strip():
+            await update.message.reply_text("❌ لم أتمكن من الحصول على إجابة. يرجى المحاولة مرة أخرى.")
+    
     async def photo_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج الصور - محسن"""
         try:
@@ -333,7 +528,7 @@ class BotHandlers:
             caption = update.message.caption or "صف هذه الصورة بالتفصيل باللغة العربية"
             
             # تحليل الصورة
-            response = await self.gemini_handler.analyze_image(bytes(photo_data), caption)
+            response = await self.gemini_handler.analyze_image(bytes(photo_data), caption, user.id)
             
             # تقسيم الرد إذا كان طويلاً
             if len(response) > self.config.MAX_MESSAGE_LENGTH:
@@ -346,6 +541,8 @@ class BotHandlers:
                 # إرسال الرد
                 await update.message.reply_text(f"📸 **تحليل الصورة:**\n\n{response}")
             
+        except GeminiError as e:
+            await self.handle_error(update, context, e, e.reason)
         except Exception as e:
             logger.error(f"خطأ في معالج الصور: {e}")
             await update.message.reply_text("❌ حدث خطأ في تحليل الصورة. يرجى المحاولة مرة أخرى.")
@@ -378,6 +575,10 @@ class BotHandlers:
                 await self.admin_panel_handler(update, context)
             elif data == "broadcast":
                 await self.broadcast_handler(update, context)
+            elif data.startswith("bc_"):
+                await self.broadcast_control_handler(update, context, data)
+            elif data.startswith("tr_"):
+                await self.translation_targets_handler(update, context, data)
             
         except Exception as e:
             logger.error(f"خطأ في معالج الأزرار: {e}")
@@ -416,6 +617,7 @@ class BotHandlers:
 أرسل النص الطويل الذي تريد تلخيصه وسأقوم بتلخيصه لك.
 
 💡 يمكنني تلخيص المقالات والنصوص الطويلة بأي لغة.
+📄 يمكنك أيضاً إرسال ملف نصي (.txt).
             """
             
             keyboard = [
@@ -440,9 +642,11 @@ class BotHandlers:
 أرسل النص الذي تريد ترجمته وسأقوم بترجمته لك.
 
 💡 يمكنني الترجمة من وإلى عدة لغات.
+🌐 للترجمة إلى عدة لغات مرة واحدة اختر اللغات أولاً.
             """
             
             keyboard = [
+                [InlineKeyboardButton("🌐 ترجمة لعدة لغات", callback_data="tr_multi")],
                 [InlineKeyboardButton("🏠 العودة للرئيسية", callback_data="start")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -455,6 +659,64 @@ class BotHandlers:
         except Exception as e:
             logger.error(f"خطأ في معالج الترجمة: {e}")
     
+    def format_gemini_stats(self) -> str:
+        """ملخص حالة معالج Gemini للوحة المدير"""
+        gemini_stats = self.gemini_handler.get_stats()
+        cache = gemini_stats['cache']
+        admission = gemini_stats['admission']
+        breaker = gemini_stats['breaker']
+        hedging = gemini_stats['hedging']
+        keys_lines = '\n'.join(
+            f"• {key['name']}: {key['rpm']} طلب/د | {key['tpm']} رمز/د | مرات 429: {key['throttled']}"
+            + (" ⏸️" if key['cooling_down'] else "")
+            for key in gemini_stats['keys']
+        )
+        hedging_line = (
+            f"\n• الطلبات الاحتياطية: {hedging['hedges']} من {hedging['requests']} | "
+            f"فازت {hedging['hedge_wins']} | تُركت لامتلاء الخانات {hedging['skipped']}"
+            + ''.join(f"\n  - {key}: بعد {delay} ث" for key, delay in hedging['hedge_delays'].items())
+        ) if hedging else ""
+        tokens = gemini_stats['tokens']
+        operation_lines = '\n'.join(
+            f"• {operation}: {usage['requests']} طلب | ⬆️ {usage['input_tokens']} | ⬇️ {usage['output_tokens']}"
+            for operation, usage in tokens['operations'].items()
+        ) or "• لا يوجد"
+        top_users = ', '.join(
+            f"{user['user_id']} ({user['input_tokens'] + user['output_tokens']})" for user in tokens['top_users']
+        ) or "لا يوجد"
+        memory = gemini_stats['memory']
+        routing = gemini_stats['routing']
+        routing_lines = '\n'.join(
+            f"• {tier['name']} ({tier['model']}): {tier['requests']} طلب | أخطاء {tier['error_rate']}% | "
+            f"{tier['avg_latency']} ث" + ("" if tier['healthy'] else " ⚠️")
+            for tier in routing['tiers']
+        )
+        disk_cache = gemini_stats['disk_cache']
+        disk_line = (
+            f"• الذاكرة الدائمة: {disk_cache['size_bytes'] // 1024}/{disk_cache['max_bytes'] // 1024} KB | "
+            f"إصابات {disk_cache['hits']} | إخفاقات {disk_cache['misses']} ({disk_cache['hit_rate']}%)"
+        ) if disk_cache else "• الذاكرة الدائمة: معطلة"
+        
+        return f"""🤖 الذكاء الاصطناعي:
+• الذاكرة المؤقتة: {cache['size']}/{cache['max_entries']} | إصابات {cache['hits']} | إخفاقات {cache['misses']} ({cache['hit_rate']}%)
+{disk_line}
+• الطلبات: {admission['in_flight']}/{admission['max_concurrent']} جارية | {admission['waiting']} بالانتظار | مرفوضة {admission['rejected'] + admission['timed_out']}
+• زمن الانتظار: متوسط {admission['avg_wait']} ث | أقصى {admission['max_wait']} ث
+• قاطع الدائرة: {breaker['state']} | مرات الفتح {breaker['trips']} | إعادة المحاولة {gemini_stats['retry']['retries']}
+• طلبات مدمجة: {gemini_stats['single_flight']['shared']} من أصل {gemini_stats['single_flight']['leaders'] + gemini_stats['single_flight']['shared']}{hedging_line}
+• ذاكرة المحادثات: {memory['conversations']} محادثة | {memory['total_tokens']}/{memory['max_total_tokens']} رمز
+
+🔀 النماذج (أعيد توجيه {routing['rerouted']} طلب):
+{routing_lines}
+
+🔑 مفاتيح Gemini:
+{keys_lines}
+
+🧮 الرموز (إدخال | إخراج):
+{operation_lines}
+• الأكثر استهلاكاً: {top_users}
+• طلبات مرفوضة لطولها: {tokens['rejected']}"""
+    
     async def admin_panel_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج لوحة المدير"""
         try:
@@ -463,19 +725,46 @@ class BotHandlers:
                 return
             
             stats = self.user_manager.get_stats()
+            trends = self.user_manager.get_trends()
+            
+            daily_lines = '\n'.join(
+                f"• {day['start'].strftime('%m-%d')}: 👤 {day['active_users']} | 💬 {day['messages']} | 🆕 {day['new_users']}"
+                for day in reversed(trends['daily'])
+            )
+            
+            # الرسائل الجماعية الجارية أو المتوقفة
+            active_jobs = self.broadcast_engine.active_jobs()
+            jobs_lines = '\n'.join(
+                f"• {job.job_id}: {job.sent + job.failed}/{job.total} ({'⏸️' if job.status == BroadcastJob.PAUSED else '▶️'})"
+                for job in active_jobs
+            ) or "• لا توجد"
             
             admin_message = f"""
 👑 لوحة تحكم المدير:
 
 📊 الإحصائيات:
 • المستخدمين: {stats['total_users']}
+• النشطون (يستقبلون الرسائل): {stats['active_users']}
 • الرسائل: {stats['total_messages']}
 • المتوسط: {stats['avg_messages_per_user']} رسالة/مستخدم
 
+📅 آخر 7 أيام (نشطون | رسائل | جدد):
+{daily_lines}
+
+📉 الرسائل آخر 24 ساعة: {self.format_trend(trends['hourly'], 'messages')}
+
+{self.format_gemini_stats()}
+
+📤 الرسائل الجماعية الجارية:
+{jobs_lines}
+
 🛠️ الأدوات المتاحة:
             """
             
-            keyboard = [
+            keyboard = []
+            for job in active_jobs:
+                keyboard.extend(self.broadcast_controls(job).inline_keyboard)
+            keyboard += [
                 [InlineKeyboardButton("📤 رسالة جماعية", callback_data="broadcast")],
                 [InlineKeyboardButton("🔄 تحديث الإحصائيات", callback_data="admin_panel")],
                 [InlineKeyboardButton("🏠 العودة للرئيسية", callback_data="start")]
@@ -515,50 +804,108 @@ class BotHandlers:
         except Exception as e:
             logger.error(f"خطأ في معالج الرسائل الجماعية: {e}")
     
+    def format_broadcast_progress(self, job: BroadcastJob) -> str:
+        """نص تقدم الرسالة الجماعية"""
+        stats = job.stats()
+        titles = {
+            BroadcastJob.RUNNING: "📤 جاري إرسال الرسالة الجماعية...",
+            BroadcastJob.PAUSED: "⏸️ الرسالة الجماعية متوقفة مؤقتاً",
+            BroadcastJob.CANCELLED: "🛑 تم إلغاء الرسالة الجماعية",
+            BroadcastJob.DONE: "✅ تم إرسال الرسالة الجماعية:"
+        }
+        done = stats['sent'] + stats['failed']
+        remaining = max(stats['total'] - done, 0)
+        rate = stats['rate']
+        eta = f"{int(remaining / rate // 60)} دقيقة" if rate > 0 and remaining and not job.finished else "-"
+        percent = round(done * 100 / stats['total'], 1) if stats['total'] else 100
+        unreachable = sum(stats['failures'].get(category, 0) for category in UNREACHABLE)
+        
+        return f"""
+{titles.get(job.status, titles[BroadcastJob.RUNNING])}
+
+📤 تم الإرسال بنجاح: {stats['sent']}
+❌ فشل في الإرسال: {stats['failed']}
+🚫 حظروا البوت أو حذفوا حساباتهم: {unreachable}
+📊 التقدم: {done}/{stats['total']} ({percent}%)
+⚡ المعدل: {rate:.1f} رسالة/ثانية
+⏳ الوقت المتبقي: {eta}
+        """
+    
+    def broadcast_controls(self, job: BroadcastJob) -> Optional[InlineKeyboardMarkup]:
+        """أزرار التحكم بالرسالة الجماعية"""
+        if job.finished:
+            return None
+        if job.status == BroadcastJob.PAUSED:
+            toggle = InlineKeyboardButton("▶️ استئناف", callback_data=f"bc_resume:{job.job_id}")
+        else:
+            toggle = InlineKeyboardButton("⏸️ إيقاف مؤقت", callback_data=f"bc_pause:{job.job_id}")
+        return InlineKeyboardMarkup([[
+            toggle,
+            InlineKeyboardButton("🛑 إلغاء", callback_data=f"bc_cancel:{job.job_id}")
+        ]])
+    
+    async def update_broadcast_progress(self, bot, job: BroadcastJob):
+        """تحديث رسالة التقدم الخاصة بالمهمة"""
+        if not job.chat_id or not job.message_id:
+            return
+        await bot.edit_message_text(
+            chat_id=job.chat_id,
+            message_id=job.message_id,
+            text=self.format_broadcast_progress(job),
+            reply_markup=self.broadcast_controls(job)
+        )
+    
     async def broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message_text: str):
-        """إرسال رسالة جماعية"""
+        """إنشاء مهمة رسالة جماعية تعمل في الخلفية"""
         try:
             # إزالة حالة الانتظار
             self.user_states[update.effective_user.id] = {}
             
-            # الحصول على جميع المستخدمين
-            all_users = self.user_manager.get_all_users()
+            # حفظ المستخدمين المعلقين حتى يشملهم الإرسال
+            await self.user_manager.save_users()
+            # المستخدمون الذين حظروا البوت أو حذفوا حساباتهم مستبعدون
+            total_users = await asyncio.to_thread(self.user_manager.get_user_count, True)
             
-            sent_count = 0
-            failed_count = 0
+            # رسالة البدء تُحدّث بالتقدم أثناء الإرسال
+            progress_message = await update.message.reply_text(f"🚀 بدء إرسال الرسالة لـ {total_users} مستخدم...")
             
-            # إرسال رسالة البدء
-            await update.message.reply_text(f"🚀 بدء إرسال الرسالة لـ {len(all_users)} مستخدم...")
+            # المهمة محفوظة وتُستأنف تلقائياً بعد إعادة التشغيل
+            job = self.broadcast_engine.start_job(
+                context.bot,
+                f"📢 رسالة من الإدارة:\n\n{message_text}",
+                total_users,
+                progress_message.chat_id,
+                progress_message.message_id
+            )
+            await self.update_broadcast_progress(context.bot, job)
             
-            for user in all_users:
-                try:
-                    await context.bot.send_message(
-                        chat_id=user['user_id'],
-                        text=f"📢 رسالة من الإدارة:\n\n{message_text}"
-                    )
-                    sent_count += 1
-                    
-                    # تأخير بسيط لتجنب الحد الأقصى
-                    await asyncio.sleep(0.1)
-                    
-                except Exception as e:
-                    failed_count += 1
-                    logger.error(f"فشل إرسال الرسالة للمستخدم {user['user_id']}: {e}")
+        except Exception as e:
+            logger.error(f"خطأ في إرسال الرسالة الجماعية: {e}")
+            await update.message.reply_text("❌ حدث خطأ في إرسال الرسالة الجماعية.")
+    
+    async def broadcast_control_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE, data: str):
+        """إيقاف أو استئناف أو إلغاء رسالة جماعية"""
+        try:
+            if not self.config.is_admin(update.effective_user.id):
+                await update.callback_query.message.reply_text("❌ ليس لديك صلاحية للوصول لهذه الميزة.")
+                return
             
-            # إرسال تقرير النتائج
-            result_message = f"""
-✅ تم إرسال الرسالة الجماعية:
-
-📤 تم الإرسال بنجاح: {sent_count}
-❌ فشل في الإرسال: {failed_count}
-📊 المجموع: {len(all_users)}
-            """
+            action, job_id = data.split(':', 1)
+            if action == "bc_pause":
+                job = await self.broadcast_engine.pause(job_id)
+            elif action == "bc_resume":
+                job = await self.broadcast_engine.resume(context.bot, job_id)
+            else:
+                job = await self.broadcast_engine.cancel(job_id)
             
-            await update.message.reply_text(result_message)
+            if job is None:
+                await update.callback_query.message.reply_text("❌ الرسالة الجماعية غير موجودة.")
+                return
             
+            await self.update_broadcast_progress(context.bot, job)
+        
         except Exception as e:
-            logger.error(f"خطأ في إرسال الرسالة الجماعية: {e}")
-            await update.message.reply_text("❌ حدث خطأ في إرسال الرسالة الجماعية.")
+            logger.error(f"خطأ في التحكم بالرسالة الجماعية: {e}")
     
     async def process_voice_conversion(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
         """معالجة تحويل النص إلى صوت"""
@@ -584,7 +931,7 @@ class BotHandlers:
             await update.message.reply_text("❌ حدث خطأ في تحويل النص إلى صوت.")
     
     async def process_text_summary(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
-        """معالجة تلخيص النص"""
+        """معالجة تلخيص النص - النصوص الطويلة تعرض تقدمها بتعديل رسالة الحالة"""
         try:
             # إزالة حالة الانتظار
             self.user_states[update.effective_user.id] = {}
@@ -592,40 +939,171 @@ class BotHandlers:
             # إرسال رسالة "يكتب..."
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             
-            # تلخيص النص
-            summary = await self.gemini_handler.summarize_text(text)
+            status = None
+            last_edit = 0.0
+            stage_names = {
+                'map': "تلخيص أجزاء النص",
+                'reduce': "دمج الملخصات",
+                'final': "كتابة التلخيص النهائي"
+            }
             
-            # إرسال التلخيص
-            await update.message.reply_text(f"📝 **تلخيص النص:**\n\n{summary}")
+            async def report_progress(stage: str, done: int, total: int):
+                nonlocal status, last_edit
+                now = time.monotonic()
+                # أول تحديث وآخر تحديث لكل مرحلة دائماً، والباقي متباعد
+                if status is not None and done not in (0, total) and now - last_edit < self.config.STREAM_EDIT_INTERVAL:
+                    return
+                last_edit = now
+                text = f"⏳ {stage_names.get(stage, stage)}..."
+                if total > 1:
+                    text += f" {done}/{total}"
+                try:
+                    status = await self.show_partial(update, status, text)
+                except Exception as e:
+                    # فشل عرض التقدم لا يوقف التلخيص
+                    logger.warning(f"تعذر تحديث تقدم التلخيص: {e}")
             
+            # تلخيص النص
+            summary = await self.gemini_handler.summarize_text(text, update.effective_user.id, report_progress)
+            
+            # إرسال التلخيص - في رسالة الحالة إن وجدت
+            reply = f"📝 **تلخيص النص:**\n\n{summary}"
+            limit = self.config.MAX_MESSAGE_LENGTH
+            parts = [reply[i:i+limit] for i in range(0, len(reply), limit)]
+            await self.show_partial(update, status, parts[0], final=True)
+            for part in parts[1:]:
+                await update.message.reply_text(part)
+            
+        except GeminiError as e:
+            await self.handle_error(update, context, e, e.reason)
         except Exception as e:
             logger.error(f"خطأ في تلخيص النص: {e}")
             await update.message.reply_text("❌ حدث خطأ في تلخيص النص.")
     
+    async def document_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """معالج الملفات النصية - تلخيص ملفات .txt"""
+        try:
+            user = update.effective_user
+            self.user_manager.add_user(user.id, user.username, user.first_name)
+            
+            if not self.user_states.get(user.id, {}).get('waiting_for_summary_text'):
+                await update.message.reply_text("📄 لتلخيص ملف نصي اختر \"📝 تلخيص\" من القائمة ثم أرسل الملف.")
+                return
+            
+            document = update.message.document
+            if document.file_size and document.file_size > self.config.SUMMARY_MAX_FILE_KB * 1024:
+                await self.handle_error(update, context, ValueError("ملف كبير"), "size")
+                return
+            
+            file = await document.get_file()
+            data = await file.download_as_bytearray()
+            try:
+                text = bytes(data).decode('utf-8-sig')
+            except UnicodeDecodeError:
+                await self.handle_error(update, context, ValueError("ترميز غير مدعوم"), "format")
+                return
+            
+            if not text.strip():
+                await update.message.reply_text("❌ الملف فارغ.")
+                return
+            
+            await self.process_text_summary(update, context, text)
+        
+        except Exception as e:
+            logger.error(f"خطأ في معالج الملفات: {e}")
+            await update.message.reply_text("❌ حدث خطأ في قراءة الملف.")
+    
     async def process_text_translation(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
         """معالجة ترجمة النص"""
         try:
             # إزالة حالة الانتظار
+            targets = self.user_states.get(update.effective_user.id, {}).get('translation_targets')
             self.user_states[update.effective_user.id] = {}
             
             # إرسال رسالة "يكتب..."
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             
+            # ترجمة لعدة لغات مختارة - رسالة لكل لغة
+            if targets:
+                translations = await self.gemini_handler.translate_many(text, targets, update.effective_user.id)
+                limit = self.config.MAX_MESSAGE_LENGTH
+                for code, translation in translations.items():
+                    name = self.gemini_handler.LANGUAGE_NAMES.get(code, code)
+                    reply = f"🌍 **{name}:**\n\n{translation}"
+                    for i in range(0, len(reply), limit):
+                        await update.message.reply_text(reply[i:i+limit])
+                return
+            
             # ترجمة النص (تلقائية - من العربية للإنجليزية والعكس)
             if any(char in text for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'):
                 # النص بالإنجليزية، ترجمة للعربية
-                translation = await self.gemini_handler.translate_text(text, "ar")
+                translation = await self.gemini_handler.translate_text(text, "ar", update.effective_user.id)
             else:
                 # النص بالعربية، ترجمة للإنجليزية
-                translation = await self.gemini_handler.translate_text(text, "en")
+                translation = await self.gemini_handler.translate_text(text, "en", update.effective_user.id)
             
             # إرسال الترجمة
             await update.message.reply_text(f"🌍 **ترجمة النص:**\n\n{translation}")
             
+        except GeminiError as e:
+            await self.handle_error(update, context, e, e.reason)
         except Exception as e:
             logger.error(f"خطأ في ترجمة النص: {e}")
             await update.message.reply_text("❌ حدث خطأ في ترجمة النص.")
     
+    def translation_targets_keyboard(self, selected: List[str]) -> InlineKeyboardMarkup:
+        """أزرار اختيار لغات الترجمة مع علامة على المختارة"""
+        buttons = [
+            InlineKeyboardButton(f"✅ {name}" if code in selected else name, callback_data=f"tr_toggle_{code}")
+            for code, name in self.gemini_handler.LANGUAGE_NAMES.items()
+        ]
+        keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
+        keyboard.append([InlineKeyboardButton("✔️ تم", callback_data="tr_done")])
+        keyboard.append([InlineKeyboardButton("🏠 العودة للرئيسية", callback_data="start")])
+        return InlineKeyboardMarkup(keyboard)
+    
+    async def translation_targets_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE, data: str):
+        """اختيار عدة لغات للترجمة - كل ضغطة تضيف اللغة أو تزيلها"""
+        try:
+            query = update.callback_query
+            user_id = update.effective_user.id
+            state = self.user_states.get(user_id, {})
+            selected = list(state.get('translation_targets', []))
+            
+            if data == "tr_multi":
+                self.user_states[user_id] = {'waiting_for_translation_text': True, 'translation_targets': []}
+                await query.message.reply_text(
+                    "🌐 اختر اللغات التي تريد الترجمة إليها ثم اضغط \"تم\":",
+                    reply_markup=self.translation_targets_keyboard([])
+                )
+                return
+            
+            if data == "tr_done":
+                if not selected:
+                    await query.message.reply_text("⚠️ اختر لغة واحدة على الأقل.")
+                    return
+                names = "، ".join(self.gemini_handler.LANGUAGE_NAMES.get(code, code) for code in selected)
+                await query.message.reply_text(f"🌍 أرسل النص الذي تريد ترجمته إلى: {names}")
+                return
+            
+            code = data[len("tr_toggle_"):]
+            if code not in self.gemini_handler.LANGUAGE_NAMES:
+                return
+            if code in selected:
+                selected.remove(code)
+            else:
+                selected.append(code)
+            self.user_states[user_id] = {'waiting_for_translation_text': True, 'translation_targets': selected}
+            
+            try:
+                await query.message.edit_reply_markup(reply_markup=self.translation_targets_keyboard(selected))
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+        
+        except Exception as e:
+            logger.error(f"خطأ في اختيار لغات الترجمة: {e}")
+    
     async def admin_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج أمر المدير"""
         if self.config.is_admin(update.effective_user.id):
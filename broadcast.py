@@ -0,0 +1,416 @@
+"""
+محرك الرسائل الجماعية - معدل إرسال محدود وتوازي مضبوط ومهام قابلة للاستئناف
+"""
+
+import logging
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """مدة الانتظار المطلوبة من تلكرام (رقم أو timedelta حسب إصدار المكتبة)"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+# أنواع الفشل التي تعني أن المستخدم لم يعد قابلاً للوصول
+UNREACHABLE = ('blocked', 'deactivated', 'not_found')
+
+def classify_delivery_error(error: Exception) -> str:
+    """تصنيف خطأ الإرسال"""
+    message = str(error).lower()
+    if isinstance(error, RetryAfter):
+        return 'rate_limited'
+    if isinstance(error, Forbidden):
+        # حظر البوت، حذف الحساب، أو طرد البوت من المجموعة
+        return 'deactivated' if 'deactivated' in message else 'blocked'
+    if isinstance(error, BadRequest):
+        if 'chat not found' in message or 'user not found' in message or 'peer_id_invalid' in message:
+            return 'not_found'
+        return 'bad_request'
+    if isinstance(error, NetworkError):
+        return 'transient'
+    return 'other'
+
+class TokenBucket:
+    """دلو رموز مشترك لتحديد معدل الإرسال الكلي"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate  # رسائل في الثانية
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """انتظار رمز إرسال - المنتظرون يُخدمون بالترتيب"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def block_for(self, seconds: float):
+        """إيقاف كل الإرسال مؤقتاً (عند RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+class BroadcastJob:
+    """رسالة جماعية محفوظة مع نقطة استئناف"""
+    
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    CANCELLED = 'cancelled'
+    DONE = 'done'
+    
+    def __init__(self, job_id: str, text: str, total: int, chat_id: int = None, message_id: int = None,
+                 status: str = RUNNING, cursor: int = None, done_ids: List[int] = None,
+                 sent: int = 0, failed: int = 0, failures: Dict[str, int] = None, created: float = None):
+        self.job_id = job_id
+        self.text = text
+        self.total = total
+        self.chat_id = chat_id  # محادثة رسالة التقدم
+        self.message_id = message_id
+        self.status = status
+        self.cursor = cursor  # كل المعرفات حتى هذا المعرف تمت معالجتها
+        self.completed = set(done_ids or [])  # معرفات بعد المؤشر تمت معالجتها خارج الترتيب
+        self.sent = sent
+        self.failed = failed
+        self.failures = failures or {}  # عدد الفشل لكل نوع
+        self.created = created or time.time()
+        
+        # حالة التشغيل الحالية فقط (لا تُحفظ)
+        self.issued = deque()  # المعرفات المرسلة للعمال بالترتيب
+        self.resumed = asyncio.Event()
+        if status == self.RUNNING:
+            self.resumed.set()
+        self.stopping = False
+        self.run_started = time.monotonic()
+        self.run_processed = 0
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.CANCELLED)
+    
+    @property
+    def halted(self) -> bool:
+        """توقف الإرسال بسبب الإلغاء أو إيقاف البوت"""
+        return self.status == self.CANCELLED or self.stopping
+    
+    def mark_done(self, user_id: int):
+        """تسجيل معالجة معرف وتقديم المؤشر عبر كل ما اكتمل بالترتيب"""
+        self.completed.add(user_id)
+        while self.issued and self.issued[0] in self.completed:
+            self.cursor = self.issued.popleft()
+            self.completed.discard(self.cursor)
+    
+    def stats(self) -> Dict:
+        """ملخص التقدم لرسالة التقدم"""
+        elapsed = time.monotonic() - self.run_started
+        return {
+            'status': self.status,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'failures': dict(self.failures),
+            'rate': self.run_processed / elapsed if elapsed > 0 else 0
+        }
+    
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'text': self.text,
+            'total': self.total,
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'status': self.status,
+            'cursor': self.cursor,
+            'done_ids': sorted(self.completed),
+            'sent': self.sent,
+            'failed': self.failed,
+            'failures': self.failures,
+            'created': self.created
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BroadcastJob':
+        return cls(**data)
+
+class BroadcastJobStore:
+    """حفظ مهام الرسائل الجماعية في ملف صغير"""
+    
+    # عدد المهام المنتهية المحتفظ بها للسجل
+    KEEP_FINISHED = 10
+    
+    def __init__(self, jobs_file: str = "broadcast_jobs.json"):
+        self.jobs_file = jobs_file
+        self._lock = threading.Lock()
+    
+    def load(self) -> List[BroadcastJob]:
+        try:
+            if os.path.exists(self.jobs_file):
+                with open(self.jobs_file, 'r', encoding='utf-8') as f:
+                    return [BroadcastJob.from_dict(data) for data in json.load(f)]
+        except Exception as e:
+            logger.error(f"خطأ في تحميل مهام الرسائل الجماعية: {e}")
+        return []
+    
+    def save(self, jobs: List[Dict]) -> bool:
+        """حفظ ذري - يمكن استدعاؤه من خيط منفصل، والحفظ المتزامن يتم بالتتابع"""
+        tmp_file = None
+        try:
+            finished = [job for job in jobs if job['status'] in (BroadcastJob.DONE, BroadcastJob.CANCELLED)]
+            keep = [job for job in jobs if job not in finished] + finished[-self.KEEP_FINISHED:]
+            
+            with self._lock:
+                # ملف مؤقت فريد في نفس المجلد حتى يبقى os.replace ذرياً
+                fd, tmp_file = tempfile.mkstemp(
+                    prefix=f"{os.path.basename(self.jobs_file)}.", suffix=".tmp",
+                    dir=os.path.dirname(os.path.abspath(self.jobs_file))
+                )
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(keep, f, ensure_ascii=False, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.jobs_file)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حفظ مهام الرسائل الجماعية: {e}")
+            if tmp_file and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return False
+
+class BroadcastEngine:
+    """إرسال رسالة لعدد كبير من المستخدمين بأقصى معدل تسمح به تلكرام"""
+    
+    def __init__(self, user_source: Callable[[Optional[int], int], List[int]],
+                 job_store: BroadcastJobStore = None, rate: float = 30, concurrency: int = 10,
+                 progress_interval: float = 5.0, checkpoint_every: int = 100, max_retries: int = 3,
+                 page_size: int = 1000,
+                 on_progress: Optional[Callable[[object, BroadcastJob], Awaitable]] = None,
+                 on_unreachable: Optional[Callable[[int], None]] = None):
+        self.user_source = user_source  # صفحة معرفات تصاعدية بعد معرف معين - تُستدعى في خيط منفصل
+        self.page_size = page_size
+        self.job_store = job_store or BroadcastJobStore()
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.checkpoint_every = checkpoint_every  # حفظ المؤشر كل عدد من الرسائل المعالجة
+        self.max_retries = max_retries
+        self.on_progress = on_progress
+        self.on_unreachable = on_unreachable  # لتعطيل المستخدمين الذين حظروا البوت
+        self.jobs: Dict[str, BroadcastJob] = {job.job_id: job for job in self.job_store.load()}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._checkpoint_lock = asyncio.Lock()
+    
+    def start_job(self, bot, text: str, total: int, chat_id: int = None, message_id: int = None) -> BroadcastJob:
+        """إنشاء مهمة جديدة وتشغيلها في الخلفية"""
+        job = BroadcastJob(uuid.uuid4().hex[:8], text, total, chat_id, message_id)
+        self.jobs[job.job_id] = job
+        self._launch(bot, job)
+        return job
+    
+    def resume_jobs(self, bot) -> int:
+        """استئناف المهام التي كانت تعمل قبل إعادة التشغيل"""
+        resumed = 0
+        for job in self.jobs.values():
+            if job.status == BroadcastJob.RUNNING and job.job_id not in self.tasks:
+                logger.info(f"▶️ استئناف الرسالة الجماعية {job.job_id} من المعرف {job.cursor}")
+                self._launch(bot, job)
+                resumed += 1
+        return resumed
+    
+    def active_jobs(self) -> List[BroadcastJob]:
+        return [job for job in self.jobs.values() if not job.finished]
+    
+    def _launch(self, bot, job: BroadcastJob):
+        task = asyncio.create_task(self._run_job(bot, job))
+        self.tasks[job.job_id] = task
+        # قد تُستأنف المهمة قبل انتهاء المهمة السابقة، فلا تُزال إلا مهمتها هي
+        task.add_done_callback(
+            lambda done: self.tasks.pop(job.job_id) if self.tasks.get(job.job_id) is done else None
+        )
+    
+    async def pause(self, job_id: str) -> Optional[BroadcastJob]:
+        job = self.jobs.get(job_id)
+        if job and job.status == BroadcastJob.RUNNING:
+            job.status = BroadcastJob.PAUSED
+            job.resumed.clear()
+            await self.checkpoint()
+        return job
+    
+    async def resume(self, bot, job_id: str) -> Optional[BroadcastJob]:
+        job = self.jobs.get(job_id)
+        if job and job.status == BroadcastJob.PAUSED:
+            job.status = BroadcastJob.RUNNING
+            job.resumed.set()
+            if job_id not in self.tasks:
+                self._launch(bot, job)
+            await self.checkpoint()
+        return job
+    
+    async def cancel(self, job_id: str) -> Optional[BroadcastJob]:
+        job = self.jobs.get(job_id)
+        if job and not job.finished:
+            job.status = BroadcastJob.CANCELLED
+            job.resumed.set()  # تحرير العمال المنتظرين ليخرجوا
+            await self.checkpoint()
+        return job
+    
+    async def checkpoint(self):
+        """حفظ حالة كل المهام خارج حلقة الأحداث - بالتتابع حتى لا تحل لقطة أقدم محل أحدث"""
+        async with self._checkpoint_lock:
+            snapshot = [job.to_dict() for job in self.jobs.values()]
+            await asyncio.to_thread(self.job_store.save, snapshot)
+    
+    async def shutdown(self, timeout: float = 10.0):
+        """إيقاف المهام مع إنهاء الإرسال الجاري وحفظ نقطة الاستئناف"""
+        for job in self.jobs.values():
+            job.stopping = True
+            job.resumed.set()
+        tasks = list(self.tasks.values())
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        await self.checkpoint()
+    
+    async def _run_job(self, bot, job: BroadcastJob):
+        """تنفيذ مهمة من نقطة الاستئناف حتى النهاية"""
+        job.issued.clear()
+        job.run_started = time.monotonic()
+        job.run_processed = 0
+        already_done = set(job.completed)
+        interrupted = False
+        
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [
+            asyncio.create_task(self._worker(bot, queue, job))
+            for _ in range(self.concurrency)
+        ]
+        reporter = asyncio.create_task(self._report(bot, job))
+        
+        try:
+            after_id = job.cursor
+            while not job.halted:
+                # قراءة المخزن تحجب، فتُجلب كل صفحة خارج حلقة الأحداث
+                page = await asyncio.to_thread(self.user_source, after_id, self.page_size)
+                if not page:
+                    break
+                after_id = page[-1]
+                for user_id in page:
+                    if job.halted:
+                        break
+                    job.issued.append(user_id)
+                    if user_id in already_done:
+                        # أُرسلت قبل إعادة التشغيل
+                        job.mark_done(user_id)
+                        continue
+                    await queue.put(user_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except Exception as e:
+            # إيقاف مؤقت بدل البقاء "قيد التشغيل" دون مهمة - يستأنفها المشرف من آخر نقطة محفوظة
+            logger.error(f"خطأ في الرسالة الجماعية {job.job_id}، أوقفت مؤقتاً: {e}")
+            interrupted = True
+            if not job.halted:
+                job.status = BroadcastJob.PAUSED
+                job.resumed.clear()
+                # هذه المهمة منتهية، فالاستئناف يشغّل مهمة جديدة
+                self.tasks.pop(job.job_id, None)
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+        
+        if not interrupted and not job.halted and not job.finished:
+            job.status = BroadcastJob.DONE
+        await self.checkpoint()
+        if not job.stopping:
+            await self._notify(bot, job)
+    
+    async def _worker(self, bot, queue: asyncio.Queue, job: BroadcastJob):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            await job.resumed.wait()
+            if job.halted:
+                # يبقى المعرف غير مكتمل ليُرسل عند الاستئناف
+                continue
+            try:
+                outcome = await self._deliver(bot, user_id, job.text)
+            except Exception as e:
+                logger.error(f"خطأ غير متوقع في الإرسال للمستخدم {user_id}: {e}")
+                outcome = 'other'
+            if outcome == 'sent':
+                job.sent += 1
+            else:
+                job.failed += 1
+                job.failures[outcome] = job.failures.get(outcome, 0) + 1
+                if outcome in UNREACHABLE and self.on_unreachable:
+                    self.on_unreachable(user_id)
+            job.run_processed += 1
+            job.mark_done(user_id)
+            if self.checkpoint_every and job.run_processed % self.checkpoint_every == 0:
+                # بعد التعطل يُعاد إرسال ما بعد آخر حفظ فقط (حتى checkpoint_every رسالة تقريباً)
+                await self.checkpoint()
+    
+    async def _deliver(self, bot, chat_id: int, text: str) -> str:
+        """إرسال رسالة واحدة، يعيد 'sent' أو نوع الفشل"""
+        category = 'other'
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return 'sent'
+            except TelegramError as e:
+                category = classify_delivery_error(e)
+                if category == 'rate_limited':
+                    self.bucket.block_for(retry_after_seconds(e))
+                elif category == 'transient':
+                    await asyncio.sleep(2 ** attempt)
+                else:
+                    if category not in UNREACHABLE:
+                        logger.warning(f"فشل إرسال الرسالة للمستخدم {chat_id}: {e}")
+                    return category
+        
+        logger.warning(f"فشل إرسال الرسالة للمستخدم {chat_id} بعد {self.max_retries + 1} محاولات")
+        return category
+    
+    async def _report(self, bot, job: BroadcastJob):
+        """حفظ نقطة الاستئناف وتحديث التقدم كل فترة"""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            try:
+                await self.checkpoint()
+                if job.resumed.is_set():
+                    await self._notify(bot, job)
+            except Exception as e:
+                logger.warning(f"تعذر تحديث تقدم الرسالة الجماعية: {e}")
+    
+    async def _notify(self, bot, job: BroadcastJob):
+        if self.on_progress:
+            try:
+                await self.on_progress(bot, job)
+            except Exception as e:
+                logger.warning(f"تعذر تحديث تقدم الرسالة الجماعية: {e}")
@@ -3,6 +3,7 @@
 """
 
 import os
+import hashlib
 from dotenv import load_dotenv
 
 # تحميل متغيرات البيئة
@@ -17,19 +18,127 @@ class Config:
         self.GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
         self.ADMIN_CHAT_ID = int(os.getenv('ADMIN_CHAT_ID', '0'))
         
+        # عدة مفاتيح/مشاريع Gemini مفصولة بفواصل لزيادة الحصة الكلية
+        self.GEMINI_API_KEYS = [
+            key.strip() for key in os.getenv('GEMINI_API_KEYS', '').split(',') if key.strip()
+        ]
+        if not self.GEMINI_API_KEY and self.GEMINI_API_KEYS:
+            self.GEMINI_API_KEY = self.GEMINI_API_KEYS[0]
+        if not self.GEMINI_API_KEYS and self.GEMINI_API_KEY:
+            self.GEMINI_API_KEYS = [self.GEMINI_API_KEY]
+        
+        # حصة كل مفتاح في الدقيقة (0 = بلا حد محلي) ومدة إيقافه بعد 429
+        self.GEMINI_KEY_RPM = int(os.getenv('GEMINI_KEY_RPM', '0'))
+        self.GEMINI_KEY_TPM = int(os.getenv('GEMINI_KEY_TPM', '0'))
+        self.GEMINI_KEY_COOLDOWN = float(os.getenv('GEMINI_KEY_COOLDOWN', '60'))
+        
         # إعدادات Gemini
         self.GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
         self.GEMINI_VISION_MODEL = os.getenv('GEMINI_VISION_MODEL', 'gemini-1.5-flash')
         
+        # مستويات النماذج من الأرخص للأكبر وجدول توجيه الطلبات بينها
+        # GEMINI_MODEL_TIERS="fast=gemini-1.5-flash-8b,standard=gemini-1.5-flash,large=gemini-1.5-pro"
+        # GEMINI_ROUTES="chat:2000:fast,*:8000:standard,*:0:large" (العملية:أقصى عدد أحرف:المستوى، 0 بلا حد)
+        self.GEMINI_MODEL_TIERS = self.parse_model_tiers(os.getenv('GEMINI_MODEL_TIERS', ''))
+        if not self.GEMINI_MODEL_TIERS:
+            self.GEMINI_MODEL_TIERS = {'standard': self.GEMINI_MODEL}
+        self.GEMINI_ROUTES = self.parse_routes(os.getenv('GEMINI_ROUTES', ''))
+        if not self.GEMINI_ROUTES:
+            self.GEMINI_ROUTES = [('*', 0, next(iter(self.GEMINI_MODEL_TIERS)))]
+        self.GEMINI_ROUTE_MAX_ERROR_RATE = float(os.getenv('GEMINI_ROUTE_MAX_ERROR_RATE', '0.3'))
+        self.GEMINI_ROUTE_MAX_LATENCY = float(os.getenv('GEMINI_ROUTE_MAX_LATENCY', '15'))
+        self.GEMINI_ROUTE_WINDOW = float(os.getenv('GEMINI_ROUTE_WINDOW', '60'))
+        
         # إعدادات عامة
         self.MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', '4000'))
         self.VOICE_LANGUAGE = os.getenv('VOICE_LANGUAGE', 'ar')
         self.DEFAULT_LANGUAGE = os.getenv('DEFAULT_LANGUAGE', 'ar')
         
+        # إعدادات تخزين المستخدمين
+        self.USER_STORE_BACKEND = os.getenv('USER_STORE_BACKEND', 'sqlite')
+        self.USER_STORE_PATH = os.getenv('USER_STORE_PATH', '')
+        self.USER_STORE_BATCH_SIZE = int(os.getenv('USER_STORE_BATCH_SIZE', '100'))
+        self.USER_STORE_FLUSH_INTERVAL = float(os.getenv('USER_STORE_FLUSH_INTERVAL', '5'))
+        self.STATS_FILE = os.getenv('STATS_FILE', 'stats.json')
+        
+        # إعدادات الرسائل الجماعية
+        self.BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+        self.BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+        self.BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '5'))
+        self.BROADCAST_CHECKPOINT_EVERY = int(os.getenv('BROADCAST_CHECKPOINT_EVERY', '100'))
+        self.BROADCAST_JOBS_FILE = os.getenv('BROADCAST_JOBS_FILE', 'broadcast_jobs.json')
+        
+        # الذاكرة المؤقتة للردود (الصلاحية بالثواني، 0 لتعطيلها للعملية)
+        self.RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+        self.CACHE_TTL_SUMMARIZE = float(os.getenv('CACHE_TTL_SUMMARIZE', '86400'))
+        self.CACHE_TTL_TRANSLATE = float(os.getenv('CACHE_TTL_TRANSLATE', '86400'))
+        self.CACHE_TTL_ANSWER = float(os.getenv('CACHE_TTL_ANSWER', '3600'))
+        self.CACHE_TTL_CHAT = float(os.getenv('CACHE_TTL_CHAT', '0'))
+        
+        # الذاكرة الدائمة للترجمة والتلخيص (ضعها على Volume حتى تبقى بعد إعادة النشر)
+        self.PERSISTENT_CACHE_PATH = os.getenv('PERSISTENT_CACHE_PATH', 'response_cache.db')
+        self.PERSISTENT_CACHE_MAX_MB = float(os.getenv('PERSISTENT_CACHE_MAX_MB', '100'))
+        
+        # حد طلبات Gemini المتزامنة وطابور الانتظار
+        self.GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+        self.GEMINI_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', '50'))
+        self.GEMINI_QUEUE_TIMEOUT = float(os.getenv('GEMINI_QUEUE_TIMEOUT', '10'))
+        
+        # إعادة المحاولة وقاطع الدائرة
+        self.GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '3'))
+        self.GEMINI_RETRY_BASE_DELAY = float(os.getenv('GEMINI_RETRY_BASE_DELAY', '0.5'))
+        self.GEMINI_RETRY_MAX_DELAY = float(os.getenv('GEMINI_RETRY_MAX_DELAY', '8'))
+        self.GEMINI_REQUEST_DEADLINE = float(os.getenv('GEMINI_REQUEST_DEADLINE', '30'))
+        self.GEMINI_BREAKER_THRESHOLD = int(os.getenv('GEMINI_BREAKER_THRESHOLD', '5'))
+        self.GEMINI_BREAKER_COOLDOWN = float(os.getenv('GEMINI_BREAKER_COOLDOWN', '30'))
+        
+        # الطلبات الاحتياطية: طلب ثانٍ إذا تجاوز الأول نسبة مئوية من زمن الاستجابة
+        self.GEMINI_HEDGING = os.getenv('GEMINI_HEDGING', 'false').lower() == 'true'
+        self.GEMINI_HEDGE_PERCENTILE = float(os.getenv('GEMINI_HEDGE_PERCENTILE', '95'))
+        self.GEMINI_HEDGE_BUDGET = float(os.getenv('GEMINI_HEDGE_BUDGET', '0.05'))
+        
+        # حد رموز الإدخال لكل طلب وحد المخرجات لكل عملية
+        self.GEMINI_MAX_INPUT_TOKENS = int(os.getenv('GEMINI_MAX_INPUT_TOKENS', '30000'))
+        self.GEMINI_MAX_OUTPUT_CHAT = int(os.getenv('GEMINI_MAX_OUTPUT_CHAT', '1024'))
+        self.GEMINI_MAX_OUTPUT_ANSWER = int(os.getenv('GEMINI_MAX_OUTPUT_ANSWER', '2048'))
+        self.GEMINI_MAX_OUTPUT_SUMMARIZE = int(os.getenv('GEMINI_MAX_OUTPUT_SUMMARIZE', '1024'))
+        self.GEMINI_MAX_OUTPUT_TRANSLATE = int(os.getenv('GEMINI_MAX_OUTPUT_TRANSLATE', '2048'))
+        self.GEMINI_MAX_OUTPUT_TRANSLATE_BATCH = int(os.getenv('GEMINI_MAX_OUTPUT_TRANSLATE_BATCH', '8192'))
+        self.GEMINI_MAX_OUTPUT_IMAGE = int(os.getenv('GEMINI_MAX_OUTPUT_IMAGE', '1024'))
+        
+        # ذاكرة المحادثة لكل مستخدم
+        self.CHAT_MEMORY_EXCHANGES = int(os.getenv('CHAT_MEMORY_EXCHANGES', '6'))
+        self.CHAT_MEMORY_MAX_TOKENS = int(os.getenv('CHAT_MEMORY_MAX_TOKENS', '1500'))
+        self.CHAT_MEMORY_IDLE_TTL = float(os.getenv('CHAT_MEMORY_IDLE_TTL', '1800'))
+        self.CHAT_MEMORY_MAX_TOTAL_TOKENS = int(os.getenv('CHAT_MEMORY_MAX_TOTAL_TOKENS', '2000000'))
+        self.CHAT_MEMORY_SUMMARIZE = os.getenv('CHAT_MEMORY_SUMMARIZE', 'true').lower() == 'true'
+        self.CHAT_MEMORY_SUMMARY_TOKENS = int(os.getenv('CHAT_MEMORY_SUMMARY_TOKENS', '256'))
+        
+        # تلخيص النصوص الطويلة على أجزاء بالتوازي (الحجم بالرموز التقديرية)
+        self.SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '2000'))
+        self.SUMMARY_CHUNK_OUTPUT_TOKENS = int(os.getenv('SUMMARY_CHUNK_OUTPUT_TOKENS', '400'))
+        self.SUMMARY_PARALLELISM = int(os.getenv('SUMMARY_PARALLELISM', '4'))
+        self.SUMMARY_MAX_FILE_KB = int(os.getenv('SUMMARY_MAX_FILE_KB', '512'))
+        
+        # بث ردود المحادثة بتعديل الرسالة أثناء التوليد
+        self.STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+        self.STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+        
+        # عدد التحديثات المعالجة بالتوازي (التحديثات داخل المحادثة الواحدة تبقى بالترتيب)
+        self.UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))
+        
         # إعدادات Railway
         self.PORT = int(os.getenv('PORT', '8000'))
         self.RAILWAY_ENVIRONMENT = os.getenv('RAILWAY_ENVIRONMENT', 'production')
         
+        # إعدادات استقبال التحديثات: webhook على Railway و polling للتطوير المحلي
+        railway_domain = os.getenv('RAILWAY_PUBLIC_DOMAIN', '')
+        self.WEBHOOK_URL = os.getenv('WEBHOOK_URL', f"https://{railway_domain}" if railway_domain else '').rstrip('/')
+        self.BOT_MODE = os.getenv('BOT_MODE', 'webhook' if self.WEBHOOK_URL else 'polling').lower()
+        self.WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram').strip('/')
+        self.WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or self.default_webhook_secret()
+        self.WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+        
         # التحقق من الإعدادات
         self.validate_config()
     
@@ -49,8 +158,59 @@ class Config:
         if missing_vars:
             raise ValueError(f"متغيرات البيئة المفقودة: {', '.join(missing_vars)}")
         
+        if self.BOT_MODE not in ('webhook', 'polling'):
+            raise ValueError(f"قيمة BOT_MODE غير صحيحة: {self.BOT_MODE}")
+        
+        if self.BOT_MODE == 'webhook' and not self.WEBHOOK_URL:
+            raise ValueError("وضع webhook يتطلب WEBHOOK_URL أو RAILWAY_PUBLIC_DOMAIN")
+        
+        unknown_tiers = {tier for _, _, tier in self.GEMINI_ROUTES} - set(self.GEMINI_MODEL_TIERS)
+        if unknown_tiers:
+            raise ValueError(f"GEMINI_ROUTES يشير لمستويات غير معرفة: {', '.join(sorted(unknown_tiers))}")
+        
+        if self.SUMMARY_PARALLELISM < 1:
+            raise ValueError("SUMMARY_PARALLELISM يجب أن يكون 1 على الأقل")
+        
+        if self.UPDATE_CONCURRENCY < 1:
+            raise ValueError("UPDATE_CONCURRENCY يجب أن يكون 1 على الأقل")
+        
+        if not 1 <= self.WEBHOOK_MAX_CONNECTIONS <= 100:
+            raise ValueError("WEBHOOK_MAX_CONNECTIONS يجب أن يكون بين 1 و 100")
+        
         print("✅ تم التحقق من جميع الإعدادات بنجاح")
     
+    @staticmethod
+    def parse_model_tiers(value: str) -> dict:
+        """"fast=model-a,standard=model-b" -> {المستوى: النموذج} بنفس الترتيب"""
+        tiers = {}
+        for item in value.split(','):
+            if not item.strip():
+                continue
+            name, _, model_name = item.partition('=')
+            if not name.strip() or not model_name.strip():
+                raise ValueError(f"مستوى نموذج غير صحيح في GEMINI_MODEL_TIERS: {item}")
+            tiers[name.strip()] = model_name.strip()
+        return tiers
+    
+    @staticmethod
+    def parse_routes(value: str) -> list:
+        """"chat:2000:fast,*:0:standard" -> [(العملية، أقصى عدد أحرف، المستوى)]"""
+        routes = []
+        for item in value.split(','):
+            if not item.strip():
+                continue
+            parts = [part.strip() for part in item.split(':')]
+            if len(parts) != 3 or not parts[1].isdigit():
+                raise ValueError(f"قاعدة توجيه غير صحيحة في GEMINI_ROUTES: {item}")
+            routes.append((parts[0], int(parts[1]), parts[2]))
+        return routes
+    
+    def default_webhook_secret(self) -> str:
+        """رمز سري ثابت مشتق من توكن البوت حتى لا يتغير بين عمليات النشر"""
+        if not self.TELEGRAM_BOT_TOKEN:
+            return ''
+        return hashlib.sha256(f"webhook:{self.TELEGRAM_BOT_TOKEN}".encode()).hexdigest()
+    
     def is_admin(self, user_id: int) -> bool:
         """التحقق من أن المستخدم مدير"""
         return user_id == self.ADMIN_CHAT_ID
@@ -60,9 +220,12 @@ class Config:
         return {
             'environment': self.RAILWAY_ENVIRONMENT,
             'port': self.PORT,
+            'bot_mode': self.BOT_MODE,
             'max_message_length': self.MAX_MESSAGE_LENGTH,
             'voice_language': self.VOICE_LANGUAGE,
             'default_language': self.DEFAULT_LANGUAGE,
             'gemini_model': self.GEMINI_MODEL,
-            'gemini_vision_model': self.GEMINI_VISION_MODEL
+            'gemini_vision_model': self.GEMINI_VISION_MODEL,
+            'gemini_model_tiers': self.GEMINI_MODEL_TIERS,
+            'user_store_backend': self.USER_STORE_BACKEND
         }
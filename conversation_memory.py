@@ -0,0 +1,127 @@
+"""
+ذاكرة المحادثة لكل مستخدم - آخر الرسائل بحد للرموز، مع ملخص للأقدم وحذف المحادثات الخاملة
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+from token_usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+class Exchange:
+    """رسالة المستخدم ورد المساعد عليها"""
+    
+    __slots__ = ('user_text', 'model_text', 'tokens')
+    
+    def __init__(self, user_text: str, model_text: str):
+        self.user_text = user_text
+        self.model_text = model_text
+        self.tokens = estimate_tokens(user_text) + estimate_tokens(model_text)
+
+class Conversation:
+    """محادثة مستخدم واحد"""
+    
+    __slots__ = ('exchanges', 'summary', 'summary_tokens', 'tokens', 'last_active', 'summarizing')
+    
+    def __init__(self):
+        self.exchanges = deque()
+        self.summary = ''
+        self.summary_tokens = 0
+        self.tokens = 0
+        self.last_active = time.monotonic()
+        self.summarizing = False
+    
+    def set_summary(self, summary: str):
+        summary_tokens = estimate_tokens(summary) if summary else 0
+        self.tokens += summary_tokens - self.summary_tokens
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+
+class ConversationMemory:
+    """محادثات المستخدمين مرتبة حسب آخر نشاط، بحدود لكل مستخدم وحد كلي للذاكرة"""
+    
+    def __init__(self, max_exchanges: int = 6, max_tokens: int = 1500, idle_ttl: float = 1800,
+                 max_total_tokens: int = 2000000):
+        self.max_exchanges = max_exchanges
+        self.max_tokens = max_tokens  # حد رموز محادثة المستخدم الواحد
+        self.idle_ttl = idle_ttl
+        self.max_total_tokens = max_total_tokens  # حد كل المحادثات معاً
+        self._conversations: "OrderedDict[int, Conversation]" = OrderedDict()
+        self.total_tokens = 0
+        self.evicted = 0
+    
+    def _drop(self, user_id: int):
+        conversation = self._conversations.pop(user_id, None)
+        if conversation is not None:
+            self.total_tokens -= conversation.tokens
+    
+    def prune(self, now: float = None):
+        """حذف المحادثات الخاملة ثم الأقدم نشاطاً حتى الحد الكلي - الأقدم دائماً في البداية"""
+        now = time.monotonic() if now is None else now
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_active < self.idle_ttl and self.total_tokens <= self.max_total_tokens:
+                break
+            self._drop(user_id)
+            self.evicted += 1
+    
+    def history(self, user_id: int) -> Tuple[str, List[Exchange]]:
+        """ملخص المحادثة السابقة وآخر الرسائل"""
+        self.prune()
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return '', []
+        return conversation.summary, list(conversation.exchanges)
+    
+    def add_exchange(self, user_id: int, user_text: str, model_text: str) -> List[Exchange]:
+        """إضافة رسالة ورد، ويعيد الرسائل القديمة التي خرجت من الذاكرة لتلخيصها"""
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = self._conversations[user_id] = Conversation()
+        self._conversations.move_to_end(user_id)
+        conversation.last_active = time.monotonic()
+        
+        exchange = Exchange(user_text, model_text)
+        conversation.exchanges.append(exchange)
+        conversation.tokens += exchange.tokens
+        self.total_tokens += exchange.tokens
+        
+        # الإبقاء على آخر رسالة دائماً حتى لو تجاوزت الحد وحدها
+        overflow = []
+        while len(conversation.exchanges) > 1 and (
+            len(conversation.exchanges) > self.max_exchanges
+            or conversation.tokens - conversation.summary_tokens > self.max_tokens
+        ):
+            old = conversation.exchanges.popleft()
+            conversation.tokens -= old.tokens
+            self.total_tokens -= old.tokens
+            overflow.append(old)
+        
+        self.prune()
+        return overflow
+    
+    def update_summary(self, user_id: int, summary: str):
+        """استبدال ملخص الرسائل القديمة"""
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return
+        old_tokens = conversation.tokens
+        conversation.set_summary(summary)
+        self.total_tokens += conversation.tokens - old_tokens
+    
+    def get_conversation(self, user_id: int) -> Optional[Conversation]:
+        return self._conversations.get(user_id)
+    
+    def clear(self, user_id: int):
+        """بدء محادثة جديدة"""
+        self._drop(user_id)
+    
+    def stats(self) -> Dict:
+        return {
+            'conversations': len(self._conversations),
+            'total_tokens': self.total_tokens,
+            'max_total_tokens': self.max_total_tokens,
+            'evicted': self.evicted
+        }
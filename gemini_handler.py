@@ -5,9 +5,21 @@
 import logging
 import os
 import base64
+import hashlib
+import json
 import google.generativeai as genai
 from config import Config
-from typing import Optional, List
+from conversation_memory import ConversationMemory
+from key_pool import KeyPool
+from model_router import ModelRouter, ModelTier
+import prompts
+from response_cache import PersistentCache, ResponseCache, make_cache_key, make_content_key
+from text_splitter import split_text
+from request_control import (
+    AdmissionController, CircuitBreaker, GeminiError, GeminiInputTooLargeError, Hedger, RetryPolicy, SingleFlight
+)
+from token_usage import CHARS_PER_TOKEN, TokenUsage, estimate_tokens
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, List, Tuple
 import asyncio
 
 logger = logging.getLogger(__name__)
@@ -15,15 +27,52 @@ logger = logging.getLogger(__name__)
 class GeminiHandler:
     """معالج Google Gemini AI - محسن ومستقر"""
     
+    # لغات الترجمة المدعومة
+    LANGUAGE_NAMES = {
+        "ar": "العربية",
+        "en": "الإنجليزية",
+        "fr": "الفرنسية",
+        "es": "الإسبانية",
+        "de": "الألمانية",
+        "it": "الإيطالية",
+        "ru": "الروسية",
+        "ja": "اليابانية",
+        "ko": "الكورية",
+        "zh": "الصينية"
+    }
+    
     def __init__(self):
         self.config = Config()
         
         # إعداد Gemini API
         genai.configure(api_key=self.config.GEMINI_API_KEY)
         
-        # النماذج
-        self.text_model = genai.GenerativeModel(self.config.GEMINI_MODEL)
-        self.vision_model = genai.GenerativeModel(self.config.GEMINI_VISION_MODEL)
+        # مجموعة المفاتيح - تزداد السعة بإضافة مفاتيح في GEMINI_API_KEYS
+        self.key_pool = KeyPool(
+            self.config.GEMINI_API_KEYS,
+            rpm_limit=self.config.GEMINI_KEY_RPM,
+            tpm_limit=self.config.GEMINI_KEY_TPM,
+            cooldown=self.config.GEMINI_KEY_COOLDOWN
+        )
+        
+        # النماذج - تعليمات النظام مرة واحدة مع كل نموذج بدل تكرارها في كل طلب
+        self.text_model = self.key_pool.new_model(self.config.GEMINI_MODEL, system_instruction=prompts.SYSTEM_INSTRUCTION)
+        self.vision_model = self.key_pool.new_model(
+            self.config.GEMINI_VISION_MODEL, system_instruction=prompts.IMAGE_SYSTEM_INSTRUCTION
+        )
+        
+        # توجيه الطلبات النصية بين مستويات النماذج حسب العملية والطول وحالة كل نموذج
+        self.router = ModelRouter(
+            {
+                name: self.key_pool.new_model(model_name, system_instruction=prompts.SYSTEM_INSTRUCTION)
+                for name, model_name in self.config.GEMINI_MODEL_TIERS.items()
+            },
+            self.config.GEMINI_ROUTES,
+            max_error_rate=self.config.GEMINI_ROUTE_MAX_ERROR_RATE,
+            max_latency=self.config.GEMINI_ROUTE_MAX_LATENCY,
+            window=self.config.GEMINI_ROUTE_WINDOW
+        )
+        self.vision_tier = ModelTier('vision', self.vision_model, self.config.GEMINI_ROUTE_WINDOW)
         
         # إعدادات التوليد
         self.generation_config = {
@@ -53,59 +102,295 @@ class GeminiHandler:
             }
         ]
         
+        # الذاكرة المؤقتة للردود - المحادثة غير مخزنة افتراضياً
+        self.response_cache = ResponseCache(self.config.RESPONSE_CACHE_SIZE)
+        self.cache_ttls = {
+            'summarize': self.config.CACHE_TTL_SUMMARIZE,
+            'summarize_chunk': self.config.CACHE_TTL_SUMMARIZE,
+            'translate': self.config.CACHE_TTL_TRANSLATE,
+            'answer': self.config.CACHE_TTL_ANSWER,
+            'chat': self.config.CACHE_TTL_CHAT
+        }
+        
+        # الذاكرة الدائمة للعمليات الثابتة (الترجمة والتلخيص)
+        self.persistent_cache = None
+        if self.config.PERSISTENT_CACHE_PATH:
+            try:
+                self.persistent_cache = PersistentCache(
+                    self.config.PERSISTENT_CACHE_PATH,
+                    int(self.config.PERSISTENT_CACHE_MAX_MB * 1024 * 1024)
+                )
+            except Exception as e:
+                logger.error(f"خطأ في فتح الذاكرة الدائمة: {e}")
+        
+        # حد الطلبات المتزامنة وطابور الانتظار
+        self.admission = AdmissionController(
+            self.config.GEMINI_MAX_CONCURRENCY,
+            self.config.GEMINI_MAX_QUEUE,
+            self.config.GEMINI_QUEUE_TIMEOUT
+        )
+        
+        # إعادة المحاولة للأخطاء المؤقتة وقاطع الدائرة عند تعطل الخدمة
+        self.breaker = CircuitBreaker(self.config.GEMINI_BREAKER_THRESHOLD, self.config.GEMINI_BREAKER_COOLDOWN)
+        self.retry = RetryPolicy(
+            self.breaker,
+            max_attempts=self.config.GEMINI_MAX_RETRIES + 1,
+            base_delay=self.config.GEMINI_RETRY_BASE_DELAY,
+            max_delay=self.config.GEMINI_RETRY_MAX_DELAY,
+            deadline=self.config.GEMINI_REQUEST_DEADLINE
+        )
+        
+        # دمج الطلبات المتطابقة الجارية في طلب واحد
+        self.single_flight = SingleFlight()
+        
+        # طلبات احتياطية لتقليل أبطأ الردود (اختيارية)
+        self.hedger = None
+        if self.config.GEMINI_HEDGING:
+            self.hedger = Hedger(
+                self.config.GEMINI_HEDGE_PERCENTILE, self.config.GEMINI_HEDGE_BUDGET, admission=self.admission
+            )
+        
+        # حد المخرجات لكل عملية ومحاسبة الرموز
+        self.output_limits = {
+            'chat': self.config.GEMINI_MAX_OUTPUT_CHAT,
+            'answer': self.config.GEMINI_MAX_OUTPUT_ANSWER,
+            'summarize': self.config.GEMINI_MAX_OUTPUT_SUMMARIZE,
+            'summarize_chunk': self.config.SUMMARY_CHUNK_OUTPUT_TOKENS,
+            'translate': self.config.GEMINI_MAX_OUTPUT_TRANSLATE,
+            'translate_batch': self.config.GEMINI_MAX_OUTPUT_TRANSLATE_BATCH,
+            'image': self.config.GEMINI_MAX_OUTPUT_IMAGE,
+            'memory': self.config.CHAT_MEMORY_SUMMARY_TOKENS
+        }
+        self.token_usage = TokenUsage()
+        
+        # ذاكرة المحادثة لكل مستخدم
+        self.memory = ConversationMemory(
+            max_exchanges=self.config.CHAT_MEMORY_EXCHANGES,
+            max_tokens=self.config.CHAT_MEMORY_MAX_TOKENS,
+            idle_ttl=self.config.CHAT_MEMORY_IDLE_TTL,
+            max_total_tokens=self.config.CHAT_MEMORY_MAX_TOTAL_TOKENS
+        )
+        self._background_tasks = set()
+        
         logger.info("✅ تم إعداد معالج Gemini المحسن")
     
-    async def generate_text(self, prompt: str, context: str = None) -> str:
-        """توليد نص باستخدام Gemini - محسن"""
+    def build_prompt(self, prompt: str, context: str = None) -> str:
+        """تجهيز النص النهائي - تعليمات اللغة العربية في system_instruction للنموذج"""
+        if context:
+            return prompts.CONTEXT_PROMPT.format(context=context, prompt=prompt)
+        return prompt
+    
+    def generation_config_for(self, operation: str) -> Dict:
+        """إعدادات التوليد مع حد المخرجات الخاص بالعملية"""
+        overrides = {}
+        limit = self.output_limits.get(operation)
+        if limit:
+            overrides["max_output_tokens"] = limit
+        if operation == 'translate_batch':
+            # الترجمة المجمعة ترجع JSON منظماً
+            overrides["response_mime_type"] = "application/json"
+        if not overrides:
+            return self.generation_config
+        return {**self.generation_config, **overrides}
+    
+    async def ensure_input_fits(self, model, contents, text: str):
+        """رفض الطلب إذا تجاوز حد رموز الإدخال - العد الفعلي فقط للنصوص القريبة من الحد"""
+        limit = self.config.GEMINI_MAX_INPUT_TOKENS
+        if estimate_tokens(text) <= limit // 2:
+            return
+        
+        response = await self.retry.call(lambda: self._admitted(
+            lambda: self.key_pool.call(model, lambda keyed_model: keyed_model.count_tokens_async(contents))
+        ))
+        if response.total_tokens > limit:
+            self.token_usage.rejected += 1
+            raise GeminiInputTooLargeError(f"النص يحتوي {response.total_tokens} رمزاً والحد {limit}")
+    
+    async def _admitted(self, request: Callable[[], Awaitable]):
+        """طلب واحد إلى Gemini داخل خانة قبول - الخانة لكل محاولة فلا تُحجز أثناء انتظار إعادة المحاولة"""
+        async with self.admission.slot():
+            return await request()
+    
+    async def _generate(self, tier: ModelTier, contents, operation: str = None, user_id: int = None,
+                        hedged: bool = False):
+        """استدعاء النموذج عبر طابور القبول مع إعادة المحاولة وقاطع الدائرة"""
+        generation_config = self.generation_config_for(operation)
+        
+        def attempt():
+            return tier.track(self.key_pool.call(tier.model, lambda keyed_model: keyed_model.generate_content_async(
+                contents,
+                generation_config=generation_config,
+                safety_settings=self.safety_settings
+            )))
+        
+        if hedged and self.hedger:
+            # نافذة زمن مستقلة لكل عملية ونموذج، والمحتاط يحجز خانة كل طلب بنفسه
+            hedge_key = f"{operation or '*'}/{tier.name}"
+            factory = lambda: self.hedger.call(attempt, hedge_key)
+        else:
+            factory = lambda: self._admitted(attempt)
+        
+        response = await self.retry.call(factory)
+        self.token_usage.record(operation, user_id, getattr(response, 'usage_metadata', None))
+        return response
+    
+    async def _generate_shared(self, key: str, tier: ModelTier, contents, operation: str = None,
+                               user_id: int = None, hedged: bool = False) -> str:
+        """توليد نص الرد مع مشاركة الطلب الجاري لنفس المفتاح"""
+        async def complete():
+            response = await self._generate(tier, contents, operation, user_id, hedged)
+            return response.text.strip() if response.text else ''
+        
+        return await self.single_flight.do(key, complete)
+    
+    def cache_lookup(self, final_prompt: str, operation: str):
+        """البحث في الذاكرة المؤقتة - يعيد (المفتاح، الصلاحية، الرد المخزن)"""
+        # المفتاح حسب نموذج جدول التوجيه لا البديل المؤقت عند تعثره
+        model_name = self.router.route(operation, len(final_prompt)).model_name
+        cache_key = make_cache_key(final_prompt, model_name, self.generation_config_for(operation))
+        ttl = self.cache_ttls.get(operation, 0)
+        if ttl <= 0:
+            return cache_key, 0, None
+        return cache_key, ttl, self.response_cache.get(cache_key)
+    
+    async def generate_text(self, prompt: str, context: str = None, operation: str = None,
+                            user_id: int = None) -> str:
+        """توليد نص باستخدام Gemini - محسن، مع ذاكرة مؤقتة حسب نوع العملية"""
         try:
-            # تحضير النص
-            if context:
-                full_prompt = f"السياق: {context}\n\nالسؤال: {prompt}"
-            else:
-                full_prompt = prompt
+            final_prompt = self.build_prompt(prompt, context)
             
-            # إضافة تعليمات اللغة العربية
-            system_prompt = """أنت مساعد ذكي يتحدث العربية. أجب بطريقة مفيدة ومهذبة.
-            إذا كان السؤال بالإنجليزية، يمكنك الإجابة بالإنجليزية.
-            إذا كان السؤال بالعربية، أجب بالعربية.
-            كن دقيقاً ومفيداً في إجاباتك."""
+            # البحث في الذاكرة المؤقتة
+            cache_key, ttl, cached = self.cache_lookup(final_prompt, operation)
+            if cached is not None:
+                return cached
             
-            final_prompt = f"{system_prompt}\n\n{full_prompt}"
+            tier = self.router.choose(operation, len(final_prompt))
+            await self.ensure_input_fits(tier.model, final_prompt, final_prompt)
             
-            # التوليد باستخدام المكتبة الموثوقة
-            response = await asyncio.to_thread(
-                self.text_model.generate_content,
-                final_prompt,
-                generation_config=self.generation_config,
-                safety_settings=self.safety_settings
+            # التوليد غير المتزامن - الطلبات المتطابقة المتزامنة تنتظر طلباً واحداً
+            text = await self._generate_shared(
+                cache_key, tier, final_prompt, operation, user_id, hedged=True
             )
             
-            if response.text:
-                return response.text.strip()
+            if text:
+                if ttl > 0:
+                    self.response_cache.set(cache_key, text, ttl)
+                return text
             else:
                 return "❌ لم أتمكن من الحصول على إجابة. يرجى المحاولة مرة أخرى."
                 
+        except GeminiError:
+            raise
         except Exception as e:
             logger.error(f"خطأ في توليد النص: {e}")
             return f"❌ حدث خطأ في الذكاء الاصطناعي: {str(e)}"
     
-    async def analyze_image(self, image_data: bytes, prompt: str = None) -> str:
+    async def _open_stream(self, tier: ModelTier, final_prompt: str, operation: str = None):
+        """بدء البث حتى أول جزء - هذه المرحلة فقط يمكن إعادة محاولتها"""
+        response = await self.key_pool.call(tier.model, lambda keyed_model: keyed_model.generate_content_async(
+            final_prompt,
+            generation_config=self.generation_config_for(operation),
+            safety_settings=self.safety_settings,
+            stream=True
+        ))
+        chunks = response.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, None
+        return chunks, first
+    
+    async def _open_admitted(self, request: Callable[[], Awaitable]):
+        """فتح البث داخل خانة قبول تبقى محجوزة بعد النجاح - يحررها stream_text عند انتهاء البث"""
+        await self.admission.acquire()
+        try:
+            return await request()
+        except BaseException:
+            self.admission.release()
+            raise
+    
+    async def stream_text(self, prompt: str, context: str = None, operation: str = None,
+                          user_id: int = None) -> AsyncIterator[str]:
+        """توليد نص على شكل أجزاء متتالية لعرضها قبل اكتمال الرد"""
+        final_prompt = self.build_prompt(prompt, context)
+        cache_key, ttl, cached = self.cache_lookup(final_prompt, operation)
+        if cached is not None:
+            yield cached
+            return
+        
+        parts = []
+        last = None
+        try:
+            tier = self.router.choose(operation, len(final_prompt))
+            await self.ensure_input_fits(tier.model, final_prompt, final_prompt)
+            # زمن أول جزء هو ما يُحسب على النموذج في البث، والخانة تبقى محجوزة حتى نهاية البث
+            chunks, last = await self.retry.call(
+                lambda: self._open_admitted(lambda: tier.track(self._open_stream(tier, final_prompt, operation)))
+            )
+            try:
+                if last is not None and last.text:
+                    parts.append(last.text)
+                    yield last.text
+                # بعد ظهور أول جزء للمستخدم لا يمكن إعادة المحاولة بصمت
+                if last is not None:
+                    async for chunk in chunks:
+                        last = chunk
+                        if chunk.text:
+                            parts.append(chunk.text)
+                            yield chunk.text
+            finally:
+                try:
+                    # إغلاق بث Gemini إذا توقف المستهلك قبل نهايته
+                    aclose = getattr(chunks, 'aclose', None)
+                    if aclose:
+                        await aclose()
+                finally:
+                    self.admission.release()
+        except GeminiError:
+            raise
+        except Exception as e:
+            logger.error(f"خطأ في بث النص: {e}")
+            yield f"\n\n❌ حدث خطأ في الذكاء الاصطناعي: {str(e)}" if parts else f"❌ حدث خطأ في الذكاء الاصطناعي: {str(e)}"
+            return
+        
+        # آخر جزء يحمل مجموع الاستهلاك
+        self.token_usage.record(operation, user_id, getattr(last, 'usage_metadata', None))
+        text = ''.join(parts).strip()
+        if not text:
+            yield "❌ لم أتمكن من الحصول على إجابة. يرجى المحاولة مرة أخرى."
+        elif ttl > 0:
+            self.response_cache.set(cache_key, text, ttl)
+    
+    def persistent_key(self, operation: str, text: str, prompt: str, language: str = None) -> str:
+        """مفتاح الذاكرة الدائمة حسب نموذج جدول التوجيه للعملية - تغيير التوجيه يُبطل المحفوظ"""
+        model_name = self.router.route(operation, len(prompt)).model_name
+        return make_content_key(operation, text, model_name, language)
+    
+    async def generate_persistent(self, operation: str, text: str, prompt: str, language: str = None,
+                                  user_id: int = None) -> str:
+        """توليد نتيجة عملية ثابتة مع حفظها على القرص حسب محتوى النص"""
+        if not self.persistent_cache:
+            return await self.generate_text(prompt, operation=operation, user_id=user_id)
+        
+        key = self.persistent_key(operation, text, prompt, language)
+        cached = await self.persistent_cache.get_async(key)
+        if cached is not None:
+            return cached
+        
+        result = await self.generate_text(prompt, operation=operation, user_id=user_id)
+        if not result.startswith("❌"):
+            await self.persistent_cache.set_async(key, result)
+        return result
+    
+    async def analyze_image(self, image_data: bytes, prompt: str = None, user_id: int = None) -> str:
         """تحليل صورة باستخدام Gemini Vision - محسن"""
         try:
             # التحقق من حجم الصورة
             if len(image_data) > 4 * 1024 * 1024:  # 4MB
                 return "❌ الصورة كبيرة جداً. يرجى استخدام صورة أصغر من 4MB."
             
-            # تحضير النص
-            if not prompt:
-                prompt = "صف هذه الصورة بالتفصيل باللغة العربية"
-            
-            # إضافة تعليمات
-            system_prompt = """أنت محلل صور ذكي. صف الصورة بالتفصيل باللغة العربية.
-            اذكر الأشياء المرئية، الألوان، الأشخاص، الأماكن، والأنشطة.
-            كن دقيقاً ومفيداً في وصفك."""
-            
-            final_prompt = f"{system_prompt}\n\n{prompt}"
+            # تحضير النص - تعليمات المحلل في system_instruction لنموذج الصور
+            final_prompt = prompt or prompts.DEFAULT_IMAGE_PROMPT
             
             # تحضير الصورة
             image_part = {
@@ -113,110 +398,309 @@ class GeminiHandler:
                 "data": image_data
             }
             
-            # التحليل باستخدام المكتبة الموثوقة
-            response = await asyncio.to_thread(
-                self.vision_model.generate_content,
-                [final_prompt, image_part],
-                generation_config=self.generation_config,
-                safety_settings=self.safety_settings
+            # التحليل غير المتزامن - الصورة نفسها المعاد توجيهها تُحلل مرة واحدة
+            flight_key = make_cache_key(
+                f"{final_prompt}\n{hashlib.sha256(image_data).hexdigest()}",
+                self.config.GEMINI_VISION_MODEL, self.generation_config_for('image')
+            )
+            text = await self._generate_shared(
+                flight_key, self.vision_tier, [final_prompt, image_part], 'image', user_id
             )
             
-            if response.text:
-                return response.text.strip()
+            if text:
+                return text
             else:
                 return "❌ لم أتمكن من تحليل الصورة. يرجى المحاولة مرة أخرى."
                 
+        except GeminiError:
+            raise
         except Exception as e:
             logger.error(f"خطأ في تحليل الصورة: {e}")
             return f"❌ حدث خطأ في تحليل الصورة: {str(e)}"
     
-    async def summarize_text(self, text: str) -> str:
-        """تلخيص النص"""
+    async def summarize_text(self, text: str, user_id: int = None,
+                             progress: Callable[[str, int, int], Awaitable] = None) -> str:
+        """تلخيص النص - النصوص الطويلة تُقسم وتُلخص أجزاؤها بالتوازي ثم تُدمج"""
         try:
-            prompt = f"""قم بتلخيص النص التالي بطريقة واضحة ومفيدة:
-
-النص:
-{text}
-
-قدم تلخيصاً شاملاً يغطي النقاط الرئيسية."""
+            if estimate_tokens(text) > self.config.SUMMARY_CHUNK_TOKENS:
+                return await self.summarize_long_text(text, user_id, progress)
             
-            return await self.generate_text(prompt)
+            prompt = prompts.SUMMARIZE_PROMPT.format(text=text)
             
+            return await self.generate_persistent('summarize', text, prompt, user_id=user_id)
+            
+        except GeminiError:
+            raise
         except Exception as e:
             logger.error(f"خطأ في تلخيص النص: {e}")
             return f"❌ حدث خطأ في تلخيص النص: {str(e)}"
     
-    async def translate_text(self, text: str, target_language: str = "ar") -> str:
+    async def _summarize_chunks(self, chunks: List[str], user_id: int, stage: str,
+                                progress: Callable[[str, int, int], Awaitable] = None) -> List[str]:
+        """تلخيص الأجزاء بالتوازي بحد SUMMARY_PARALLELISM مع الحفاظ على ترتيبها"""
+        semaphore = asyncio.Semaphore(self.config.SUMMARY_PARALLELISM)
+        done = 0
+        
+        async def summarize_chunk(index: int, chunk: str) -> str:
+            nonlocal done
+            prompt = prompts.SUMMARIZE_CHUNK_PROMPT.format(index=index + 1, total=len(chunks), text=chunk)
+            async with semaphore:
+                summary = await self.generate_persistent('summarize_chunk', chunk, prompt, user_id=user_id)
+            if summary.startswith("❌"):
+                raise RuntimeError(summary.lstrip("❌ "))
+            done += 1
+            if progress:
+                await progress(stage, done, len(chunks))
+            return summary
+        
+        if progress:
+            await progress(stage, 0, len(chunks))
+        tasks = [asyncio.ensure_future(summarize_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # فشل جزء واحد يفشل التلخيص كله - لا داعي لإكمال الباقي
+            for task in tasks:
+                task.cancel()
+    
+    async def summarize_long_text(self, text: str, user_id: int = None,
+                                  progress: Callable[[str, int, int], Awaitable] = None) -> str:
+        """تلخيص map-reduce: أجزاء بالتوازي، ثم دمج الملخصات على مراحل حتى تتسع لطلب واحد"""
+        key = self.persistent_key('summarize', text, text)
+        if self.persistent_cache:
+            cached = await self.persistent_cache.get_async(key)
+            if cached is not None:
+                return cached
+        
+        max_chars = self.config.SUMMARY_CHUNK_TOKENS * CHARS_PER_TOKEN
+        chunks = split_text(text, max_chars)
+        summaries = await self._summarize_chunks(chunks, user_id, 'map', progress)
+        
+        # دمج هرمي: إذا لم تتسع الملخصات لطلب واحد تُجمع وتُلخص مرة أخرى
+        combined = '\n\n'.join(summaries)
+        while estimate_tokens(combined) > self.config.SUMMARY_CHUNK_TOKENS and len(summaries) > 1:
+            groups = split_text(combined, max_chars)
+            if len(groups) >= len(summaries):
+                # الملخصات لا تصغر - الدمج النهائي مباشرة
+                break
+            summaries = await self._summarize_chunks(groups, user_id, 'reduce', progress)
+            combined = '\n\n'.join(summaries)
+        
+        if progress:
+            await progress('final', 0, 1)
+        prompt = prompts.SUMMARIZE_COMBINE_PROMPT.format(text=combined)
+        result = await self.generate_text(prompt, operation='summarize', user_id=user_id)
+        if self.persistent_cache and not result.startswith("❌"):
+            await self.persistent_cache.set_async(key, result)
+        return result
+    
+    async def translate_text(self, text: str, target_language: str = "ar", user_id: int = None) -> str:
         """ترجمة النص"""
         try:
-            language_names = {
-                "ar": "العربية",
-                "en": "الإنجليزية",
-                "fr": "الفرنسية",
-                "es": "الإسبانية",
-                "de": "الألمانية",
-                "it": "الإيطالية",
-                "ru": "الروسية",
-                "ja": "اليابانية",
-                "ko": "الكورية",
-                "zh": "الصينية"
-            }
-            
-            target_lang_name = language_names.get(target_language, target_language)
-            
-            prompt = f"""قم بترجمة النص التالي إلى {target_lang_name}:
-
-النص:
-{text}
-
-قدم الترجمة بدقة مع مراعاة المعنى والسياق."""
-            
-            return await self.generate_text(prompt)
+            prompt = self.translate_prompt(text, target_language)
+            return await self.generate_persistent('translate', text, prompt, target_language, user_id)
             
+        except GeminiError:
+            raise
         except Exception as e:
             logger.error(f"خطأ في ترجمة النص: {e}")
             return f"❌ حدث خطأ في ترجمة النص: {str(e)}"
     
-    async def answer_question(self, question: str, context: str = None) -> str:
+    def translate_prompt(self, text: str, target_language: str) -> str:
+        target_lang_name = self.LANGUAGE_NAMES.get(target_language, target_language)
+        return prompts.TRANSLATE_PROMPT.format(language=target_lang_name, text=text)
+    
+    async def translate_many(self, text: str, target_languages: List[str], user_id: int = None) -> Dict[str, str]:
+        """ترجمة النص لعدة لغات - طلب واحد يرجع JSON، أو طلبات متوازية للنصوص الطويلة"""
+        targets = list(dict.fromkeys(target_languages))
+        results = {}
+        
+        # الترجمات المحفوظة سابقاً: مفتاح translate_text ثم مفتاح نموذج الترجمة المجمعة
+        batch_model = self.router.route('translate_batch', len(text)).model_name
+        if self.persistent_cache:
+            for language in targets:
+                for key in dict.fromkeys((
+                    self.persistent_key('translate', text, self.translate_prompt(text, language), language),
+                    make_content_key('translate', text, batch_model, language)
+                )):
+                    cached = await self.persistent_cache.get_async(key)
+                    if cached is not None:
+                        results[language] = cached
+                        break
+        missing = [language for language in targets if language not in results]
+        
+        # الرد يحتوي ترجمة كاملة لكل لغة - النص الطويل لا يتسع لها في رد واحد
+        expected_tokens = estimate_tokens(text) * len(missing) * 1.5
+        if len(missing) > 1 and expected_tokens <= self.config.GEMINI_MAX_OUTPUT_TRANSLATE_BATCH:
+            try:
+                model_name, batch = await self._translate_batch(text, missing, user_id)
+            except GeminiError:
+                raise
+            except Exception as e:
+                logger.warning(f"فشلت الترجمة المجمعة، التحويل لطلبات منفصلة: {e}")
+                model_name, batch = None, {}
+            for language, translation in batch.items():
+                results[language] = translation
+                if self.persistent_cache:
+                    # تُحفظ باسم النموذج الذي ترجمها فعلاً
+                    key = make_content_key('translate', text, model_name, language)
+                    await self.persistent_cache.set_async(key, translation)
+            missing = [language for language in missing if language not in results]
+        
+        # طلب لكل لغة بالتوازي - للنصوص الطويلة أو اللغات الناقصة من الرد المجمع
+        if missing:
+            translations = await asyncio.gather(
+                *(self.translate_text(text, language, user_id) for language in missing)
+            )
+            results.update(zip(missing, translations))
+        
+        return {language: results[language] for language in targets}
+    
+    async def _translate_batch(self, text: str, languages: List[str], user_id: int = None) -> Tuple[str, Dict[str, str]]:
+        """طلب واحد لكل اللغات - يعيد اسم النموذج والترجمات الصالحة فقط"""
+        language_list = "\n".join(
+            f'- "{language}": {self.LANGUAGE_NAMES.get(language, language)}' for language in languages
+        )
+        prompt = prompts.TRANSLATE_BATCH_PROMPT.format(languages=language_list, text=text)
+        
+        # التوجيه حسب طول النص نفسه حتى يطابق مفتاح البحث في translate_many
+        tier = self.router.choose('translate_batch', len(text))
+        await self.ensure_input_fits(tier.model, prompt, prompt)
+        key = make_cache_key(prompt, tier.model_name, self.generation_config_for('translate_batch'))
+        raw = await self._generate_shared(key, tier, prompt, 'translate_batch', user_id)
+        
+        data = json.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError("الرد ليس كائن JSON")
+        return tier.model_name, {
+            language: data[language].strip()
+            for language in languages
+            if isinstance(data.get(language), str) and data[language].strip()
+        }
+    
+    async def answer_question(self, question: str, context: str = None, user_id: int = None) -> str:
         """الإجابة على سؤال"""
         try:
             # تحضير النص
             if context:
-                prompt = f"""بناءً على السياق التالي، أجب على السؤال:
-
-السياق: {context}
-
-السؤال: {question}
-
-قدم إجابة شاملة ومفيدة."""
+                prompt = prompts.ANSWER_CONTEXT_PROMPT.format(context=context, question=question)
             else:
-                prompt = f"أجب على السؤال التالي بطريقة مفيدة وشاملة: {question}"
+                prompt = prompts.ANSWER_PROMPT.format(question=question)
             
-            return await self.generate_text(prompt)
+            return await self.generate_text(prompt, operation='answer', user_id=user_id)
             
+        except GeminiError:
+            raise
         except Exception as e:
             logger.error(f"خطأ في الإجابة على السؤال: {e}")
             return f"❌ حدث خطأ في الإجابة على السؤال: {str(e)}"
     
-    async def chat_response(self, message: str, user_name: str = None) -> str:
+    def format_history(self, user_id: int) -> str:
+        """نص المحادثة السابقة لإضافته للطلب"""
+        if user_id is None:
+            return ''
+        summary, exchanges = self.memory.history(user_id)
+        history = ''
+        if summary:
+            history += f"ملخص ما سبق من المحادثة: {summary}\n\n"
+        if exchanges:
+            history += "آخر الرسائل:\n" + '\n'.join(
+                f"المستخدم: {exchange.user_text}\nالمساعد: {exchange.model_text}" for exchange in exchanges
+            ) + "\n\n"
+        return history
+    
+    def chat_prompt(self, message: str, user_name: str = None, user_id: int = None) -> str:
+        """نص المحادثة العادية مع ما سبق منها"""
+        history = self.format_history(user_id)
+        if user_name:
+            return prompts.CHAT_NAMED_PROMPT.format(user_name=user_name, history=history, message=message)
+        return prompts.CHAT_PROMPT.format(history=history, message=message)
+    
+    def remember(self, user_id: int, message: str, reply: str):
+        """حفظ الرسالة والرد في ذاكرة المحادثة وتلخيص ما خرج منها"""
+        if user_id is None or not reply or "❌" in reply:
+            return
+        overflow = self.memory.add_exchange(user_id, message, reply)
+        conversation = self.memory.get_conversation(user_id)
+        if not overflow or not self.config.CHAT_MEMORY_SUMMARIZE or conversation is None:
+            return
+        if conversation.summarizing:
+            # تلخيص جارٍ بالفعل - الرسائل الخارجة الآن تُهمل بدل تراكم الطلبات
+            return
+        conversation.summarizing = True
+        task = asyncio.create_task(self._summarize_history(user_id, conversation, overflow))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _summarize_history(self, user_id: int, conversation, exchanges: list):
+        """دمج الرسائل القديمة في ملخص المحادثة - يُهمل إذا بدأ المستخدم محادثة جديدة أثناء التلخيص"""
+        summary = conversation.summary
+        try:
+            transcript = '\n'.join(
+                f"المستخدم: {exchange.user_text}\nالمساعد: {exchange.model_text}" for exchange in exchanges
+            )
+            prompt = prompts.MEMORY_SUMMARY_PROMPT.format(
+                previous=f"الملخص السابق: {summary}\n\n" if summary else "",
+                transcript=transcript
+            )
+            result = await self.generate_text(prompt, operation='memory', user_id=user_id)
+            if not result.startswith("❌") and self.memory.get_conversation(user_id) is conversation:
+                self.memory.update_summary(user_id, result)
+        except Exception as e:
+            logger.error(f"خطأ في تلخيص المحادثة: {e}")
+        finally:
+            # المحادثة القديمة فقط - المحادثة الجديدة لها حالة تلخيص خاصة بها
+            conversation.summarizing = False
+    
+    def new_chat(self, user_id: int):
+        """بدء محادثة جديدة بدون سياق سابق"""
+        self.memory.clear(user_id)
+    
+    async def chat_response(self, message: str, user_name: str = None, user_id: int = None) -> str:
         """رد محادثة عادية"""
         try:
-            # تحضير النص
-            if user_name:
-                prompt = f"""أنت مساعد ذكي تتحدث مع {user_name}. 
-                
-رسالة المستخدم: {message}
-
-أجب بطريقة ودية ومفيدة."""
-            else:
-                prompt = f"أجب على الرسالة التالية بطريقة ودية ومفيدة: {message}"
-            
-            return await self.generate_text(prompt)
+            prompt = self.chat_prompt(message, user_name, user_id)
+            response = await self.generate_text(prompt, operation='chat', user_id=user_id)
+            self.remember(user_id, message, response)
+            return response
             
+        except GeminiError:
+            raise
         except Exception as e:
             logger.error(f"خطأ في رد المحادثة: {e}")
             return f"❌ حدث خطأ في المحادثة: {str(e)}"
     
+    async def chat_response_stream(self, message: str, user_name: str = None,
+                                   user_id: int = None) -> AsyncIterator[str]:
+        """رد محادثة عادية على شكل أجزاء متتالية"""
+        prompt = self.chat_prompt(message, user_name, user_id)
+        parts = []
+        async for chunk in self.stream_text(prompt, operation='chat', user_id=user_id):
+            parts.append(chunk)
+            yield chunk
+        self.remember(user_id, message, ''.join(parts).strip())
+    
+    def get_stats(self) -> Dict:
+        """إحصائيات معالج Gemini"""
+        return {
+            'cache': self.response_cache.stats(),
+            'disk_cache': self.persistent_cache.stats() if self.persistent_cache else None,
+            'admission': self.admission.stats(),
+            'breaker': self.breaker.stats(),
+            'retry': self.retry.stats(),
+            'single_flight': self.single_flight.stats(),
+            'hedging': self.hedger.stats() if self.hedger else None,
+            'keys': self.key_pool.stats(),
+            'tokens': self.token_usage.stats(),
+            'memory': self.memory.stats(),
+            'routing': self.router.stats()
+        }
+    
+    def close(self):
+        """إغلاق الموارد"""
+        if self.persistent_cache:
+            self.persistent_cache.close()
+    
     def test_connection(self) -> bool:
         """اختبار الاتصال بـ Gemini - محسن"""
         try:
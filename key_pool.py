@@ -0,0 +1,173 @@
+"""
+مجموعة مفاتيح Gemini - توزيع الطلبات على عدة مفاتيح/مشاريع حسب الحصة والحمل
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+# أخطاء تعني أن المفتاح تجاوز حصته
+QUOTA_ERRORS = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+
+class ApiKeyState:
+    """مفتاح واحد مع استهلاكه خلال الدقيقة الأخيرة"""
+    
+    WINDOW = 60.0
+    
+    def __init__(self, index: int, api_key: str, rpm_limit: int = 0, tpm_limit: int = 0):
+        self.index = index
+        self.api_key = api_key
+        self.name = f"#{index + 1} …{api_key[-4:]}"
+        self.rpm_limit = rpm_limit  # 0 = بلا حد محلي
+        self.tpm_limit = tpm_limit
+        self.requests = deque()  # أوقات الطلبات
+        self.tokens = deque()  # (الوقت، عدد الرموز)
+        self.tokens_in_window = 0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.total_requests = 0
+        self.throttled = 0
+        self.async_client = None
+    
+    def prune(self, now: float):
+        """إزالة ما خرج من نافذة الدقيقة"""
+        cutoff = now - self.WINDOW
+        while self.requests and self.requests[0] <= cutoff:
+            self.requests.popleft()
+        while self.tokens and self.tokens[0][0] <= cutoff:
+            self.tokens_in_window -= self.tokens.popleft()[1]
+    
+    def available(self, now: float) -> bool:
+        """المفتاح خارج فترة الإيقاف وتحت حصته"""
+        if now < self.cooldown_until:
+            return False
+        if self.rpm_limit and len(self.requests) >= self.rpm_limit:
+            return False
+        if self.tpm_limit and self.tokens_in_window >= self.tpm_limit:
+            return False
+        return True
+    
+    def load(self) -> float:
+        """نسبة استهلاك الحصة خلال الدقيقة (الأعلى بين الطلبات والرموز) من 0 إلى 1"""
+        load = 0.0
+        if self.rpm_limit:
+            load = max(load, len(self.requests) / self.rpm_limit)
+        if self.tpm_limit:
+            load = max(load, self.tokens_in_window / self.tpm_limit)
+        return load
+    
+    def ready_at(self) -> float:
+        """أقرب وقت يصبح فيه المفتاح متاحاً"""
+        ready = self.cooldown_until
+        if self.rpm_limit and len(self.requests) >= self.rpm_limit:
+            ready = max(ready, self.requests[0] + self.WINDOW)
+        if self.tpm_limit and self.tokens_in_window >= self.tpm_limit and self.tokens:
+            ready = max(ready, self.tokens[0][0] + self.WINDOW)
+        return ready
+
+class KeyPool:
+    """اختيار المفتاح الأقل حملاً تحت حصته، مع إخراج المفاتيح التي ترجع 429 مؤقتاً"""
+    
+    def __init__(self, api_keys: List[str], rpm_limit: int = 0, tpm_limit: int = 0, cooldown: float = 60.0):
+        self.keys = [ApiKeyState(index, key, rpm_limit, tpm_limit) for index, key in enumerate(api_keys)]
+        self.cooldown = cooldown
+        self._models: Dict[tuple, genai.GenerativeModel] = {}
+        self._model_args: Dict[int, tuple] = {}  # معاملات إنشاء كل نموذج أساسي
+    
+    def acquire(self) -> ApiKeyState:
+        """المفتاح الأبعد عن حصته، والأقل طلبات جارية عند التساوي، أو الأقرب توفراً إذا تجاوزت كل المفاتيح حصتها"""
+        now = time.monotonic()
+        for state in self.keys:
+            state.prune(now)
+        available = [state for state in self.keys if state.available(now)]
+        if available:
+            state = min(available, key=lambda state: (state.load(), state.in_flight, state.total_requests))
+        else:
+            # المحاولة على أقرب مفتاح - إعادة المحاولة تتولى الانتظار إذا رفضه الخادم
+            state = min(self.keys, key=lambda state: state.ready_at())
+        state.requests.append(now)
+        state.total_requests += 1
+        return state
+    
+    def new_model(self, model_name: str, **kwargs) -> genai.GenerativeModel:
+        """إنشاء نموذج أساسي مع حفظ معاملاته لإنشاء نسخة لكل مفتاح بنفس الإعداد"""
+        model = genai.GenerativeModel(model_name, **kwargs)
+        self._model_args[id(model)] = (model_name, kwargs)
+        return model
+    
+    def model_for(self, state: ApiKeyState, base_model: genai.GenerativeModel) -> genai.GenerativeModel:
+        """نسخة من النموذج مرتبطة بعميل المفتاح (عميل واحد لكل مفتاح يعاد استخدامه)"""
+        if len(self.keys) == 1:
+            return base_model
+        cache_key = (state.index, id(base_model))
+        model = self._models.get(cache_key)
+        if model is None:
+            if state.async_client is None:
+                state.async_client = glm.GenerativeServiceAsyncClient(client_options={'api_key': state.api_key})
+            model_name, kwargs = self._model_args.get(id(base_model), (base_model.model_name, {}))
+            model = genai.GenerativeModel(model_name, **kwargs)
+            # لا يوجد معامل عام لعميل النموذج - المكتبة تنشئه عند أول طلب من الإعداد العام فنمرر عميل المفتاح بدلاً منه
+            if not hasattr(model, '_async_client'):
+                # إصدار لا يحمل هذه الخاصية - تعيينها لن يُستخدم وتذهب كل الطلبات للمفتاح العام دون علم
+                self.disable_key_rotation()
+                return base_model
+            model._async_client = state.async_client
+            self._models[cache_key] = model
+        return model
+    
+    def disable_key_rotation(self):
+        """الرجوع لمفتاح واحد (المُعد في genai.configure) عندما لا تدعم المكتبة عميلاً لكل مفتاح"""
+        logger.error(
+            "❌ إصدار google-generativeai لا يدعم عميلاً لكل مفتاح (_async_client) - "
+            f"يُستخدم المفتاح الأول فقط بدل {len(self.keys)} مفاتيح"
+        )
+        self.keys = self.keys[:1]
+        self._models.clear()
+    
+    def record_tokens(self, state: ApiKeyState, tokens: int):
+        if tokens:
+            state.tokens.append((time.monotonic(), tokens))
+            state.tokens_in_window += tokens
+    
+    def throttle(self, state: ApiKeyState):
+        """إخراج المفتاح من التوزيع بعد 429"""
+        state.throttled += 1
+        state.cooldown_until = time.monotonic() + self.cooldown
+        logger.warning(f"⚠️ المفتاح {state.name} تجاوز حصته - إيقافه {self.cooldown} ثانية")
+    
+    async def call(self, base_model: genai.GenerativeModel, request: Callable[[genai.GenerativeModel], Awaitable]):
+        """تنفيذ طلب على المفتاح المختار وتسجيل استهلاكه"""
+        state = self.acquire()
+        state.in_flight += 1
+        try:
+            response = await request(self.model_for(state, base_model))
+        except QUOTA_ERRORS:
+            self.throttle(state)
+            raise
+        finally:
+            state.in_flight -= 1
+        
+        usage = getattr(response, 'usage_metadata', None)
+        self.record_tokens(state, getattr(usage, 'total_token_count', 0) if usage else 0)
+        return response
+    
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        result = []
+        for state in self.keys:
+            state.prune(now)
+            result.append({
+                'name': state.name,
+                'rpm': len(state.requests),
+                'tpm': state.tokens_in_window,
+                'in_flight': state.in_flight,
+                'throttled': state.throttled,
+                'cooling_down': now < state.cooldown_until
+            })
+        return result
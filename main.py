@@ -3,7 +3,6 @@
 بوت تلكرام للذكاء الاصطناعي - محسن لـ Railway
 """
 
-import os
 import logging
 import asyncio
 from datetime import datetime
@@ -13,6 +12,7 @@ from config import Config
 from gemini_handler import GeminiHandler
 from voice_handler import VoiceHandler
 from bot_handlers import BotHandlers
+from update_processor import ChatOrderedUpdateProcessor
 
 # إعداد التسجيل
 logging.basicConfig(
@@ -39,6 +39,10 @@ class TelegramBot:
         """أمر المساعدة"""
         await self.bot_handlers.help_handler(update, context)
     
+    async def new_chat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """أمر المحادثة الجديدة"""
+        await self.bot_handlers.new_chat_handler(update, context)
+    
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """أمر الإحصائيات"""
         await self.bot_handlers.stats_handler(update, context)
@@ -51,6 +55,10 @@ class TelegramBot:
         """معالج الصور"""
         await self.bot_handlers.photo_handler(update, context)
     
+    async def document_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """معالج الملفات"""
+        await self.bot_handlers.document_handler(update, context)
+    
     async def callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج الأزرار"""
         await self.bot_handlers.callback_handler(update, context)
@@ -59,17 +67,27 @@ class TelegramBot:
         """معالج المدراء"""
         await self.bot_handlers.admin_handler(update, context)
     
+    async def post_init(self, application: Application):
+        """تشغيل المهام الخلفية بعد تهيئة التطبيق"""
+        await self.bot_handlers.startup(application)
+    
+    async def post_shutdown(self, application: Application):
+        """تنظيف الموارد بعد إيقاف التطبيق"""
+        await self.bot_handlers.shutdown()
+    
     def setup_handlers(self):
         """إعداد معالجات البوت"""
         # أوامر أساسية
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("stats", self.stats_command))
+        self.application.add_handler(CommandHandler("new", self.new_chat_command))
         self.application.add_handler(CommandHandler("admin", self.admin_handler))
         
         # معالجات المحتوى
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.message_handler))
         self.application.add_handler(MessageHandler(filters.PHOTO, self.photo_handler))
+        self.application.add_handler(MessageHandler(filters.Document.TXT, self.document_handler))
         self.application.add_handler(CallbackQueryHandler(self.callback_handler))
         
         logger.info("✅ تم إعداد معالجات البوت")
@@ -83,11 +101,33 @@ class TelegramBot:
                 "❌ حدث خطأ مؤقت. يرجى المحاولة مرة أخرى."
             )
     
+    def run_webhook(self):
+        """تشغيل خادم webhook على منفذ Railway مع التحقق من الرمز السري"""
+        webhook_url = f"{self.config.WEBHOOK_URL}/{self.config.WEBHOOK_PATH}"
+        logger.info(f"🚀 تشغيل البوت بوضع webhook على المنفذ {self.config.PORT}")
+        
+        self.application.run_webhook(
+            listen="0.0.0.0",
+            port=self.config.PORT,
+            url_path=self.config.WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=self.config.WEBHOOK_SECRET,
+            max_connections=self.config.WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=True
+        )
+    
     def run(self):
         """تشغيل البوت"""
         try:
             # إنشاء التطبيق
-            self.application = Application.builder().token(self.config.TELEGRAM_BOT_TOKEN).build()
+            self.application = (
+                Application.builder()
+                .token(self.config.TELEGRAM_BOT_TOKEN)
+                .concurrent_updates(ChatOrderedUpdateProcessor(self.config.UPDATE_CONCURRENCY))
+                .post_init(self.post_init)
+                .post_shutdown(self.post_shutdown)
+                .build()
+            )
             
             # إعداد المعالجات
             self.setup_handlers()
@@ -95,12 +135,12 @@ class TelegramBot:
             # معالج الأخطاء
             self.application.add_error_handler(self.error_handler)
             
-            # تشغيل البوت
-            port = int(os.environ.get('PORT', 8000))
-            logger.info(f"🚀 تشغيل البوت على المنفذ {port}")
-            
             # تشغيل الخدمة
-            self.application.run_polling(drop_pending_updates=True)
+            if self.config.BOT_MODE == 'webhook':
+                self.run_webhook()
+            else:
+                logger.info("🚀 تشغيل البوت بوضع polling")
+                self.application.run_polling(drop_pending_updates=True)
             
         except Exception as e:
             logger.error(f"❌ خطأ في تشغيل البوت: {e}")
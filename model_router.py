@@ -0,0 +1,124 @@
+"""
+توجيه طلبات Gemini بين مستويات النماذج حسب العملية وطول النص وحالة كل نموذج
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Dict, List, Tuple
+import google.generativeai as genai
+from request_control import is_transient_error
+
+logger = logging.getLogger(__name__)
+
+class ModelTier:
+    """نموذج واحد مع زمن استجابته وأخطائه خلال النافذة الأخيرة"""
+    
+    def __init__(self, name: str, model: genai.GenerativeModel, window: float = 60.0):
+        self.name = name
+        self.model = model
+        self.window = window
+        self.outcomes = deque()  # (الوقت، زمن الاستجابة، نجح)
+        self.requests = 0
+        self.errors = 0
+    
+    @property
+    def model_name(self) -> str:
+        return self.model.model_name
+    
+    def prune(self, now: float):
+        cutoff = now - self.window
+        while self.outcomes and self.outcomes[0][0] <= cutoff:
+            self.outcomes.popleft()
+    
+    def record(self, latency: float, ok: bool):
+        self.outcomes.append((time.monotonic(), latency, ok))
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+    
+    async def track(self, request: Awaitable):
+        """تنفيذ الطلب وتسجيل زمنه - الأخطاء الدائمة لا تُحسب على النموذج"""
+        started = time.monotonic()
+        try:
+            response = await request
+        except Exception as e:
+            if is_transient_error(e):
+                self.record(time.monotonic() - started, False)
+            raise
+        self.record(time.monotonic() - started, True)
+        return response
+    
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, _, ok in self.outcomes if not ok) / len(self.outcomes)
+    
+    def avg_latency(self) -> float:
+        latencies = [latency for _, latency, ok in self.outcomes if ok]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+class ModelRouter:
+    """اختيار مستوى النموذج من جدول التوجيه، مع تجاوز المستوى المتعثر إلى غيره"""
+    
+    def __init__(self, models: Dict[str, genai.GenerativeModel], routes: List[Tuple[str, int, str]],
+                 max_error_rate: float = 0.3, max_latency: float = 15.0, window: float = 60.0,
+                 min_samples: int = 5):
+        # ترتيب المستويات من الأرخص للأكبر كما في الإعداد
+        self.tiers = [ModelTier(name, model, window) for name, model in models.items()]
+        self._by_name = {tier.name: tier for tier in self.tiers}
+        self.routes = routes
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_samples = min_samples
+        self.rerouted = 0
+    
+    def route(self, operation: str, input_chars: int) -> ModelTier:
+        """المستوى المحدد في جدول التوجيه - أول قاعدة تطابق العملية والطول"""
+        operation = operation or '*'
+        for route_operation, max_chars, tier_name in self.routes:
+            if route_operation not in ('*', operation):
+                continue
+            if max_chars and input_chars > max_chars:
+                continue
+            return self._by_name[tier_name]
+        # لا قاعدة مطابقة - المستوى الأخير (الأكبر)
+        return self.tiers[-1]
+    
+    def healthy(self, tier: ModelTier, now: float) -> bool:
+        tier.prune(now)
+        if len(tier.outcomes) < self.min_samples:
+            return True
+        return tier.error_rate() <= self.max_error_rate and tier.avg_latency() <= self.max_latency
+    
+    def choose(self, operation: str, input_chars: int) -> ModelTier:
+        """المستوى المناسب للطلب، أو بديل سليم إذا تعثر - الأكبر أولاً ثم الأصغر"""
+        tier = self.route(operation, input_chars)
+        now = time.monotonic()
+        if self.healthy(tier, now):
+            return tier
+        
+        index = self.tiers.index(tier)
+        for candidate in self.tiers[index + 1:] + self.tiers[:index][::-1]:
+            if self.healthy(candidate, now):
+                self.rerouted += 1
+                logger.info(f"🔀 توجيه {operation or 'طلب'} من {tier.name} إلى {candidate.name}")
+                return candidate
+        # كل المستويات متعثرة - إعادة المحاولة وقاطع الدائرة يتوليان الباقي
+        return tier
+    
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        tiers = []
+        for tier in self.tiers:
+            healthy = self.healthy(tier, now)
+            tiers.append({
+                'name': tier.name,
+                'model': tier.model_name,
+                'requests': tier.requests,
+                'errors': tier.errors,
+                'error_rate': round(tier.error_rate() * 100, 1),
+                'avg_latency': round(tier.avg_latency(), 2),
+                'healthy': healthy
+            })
+        return {'tiers': tiers, 'rerouted': self.rerouted}
@@ -0,0 +1,69 @@
+"""
+قوالب نصوص Gemini - تعليمات النظام الثابتة تُمرر مرة واحدة مع النموذج، والقوالب تُجهز عند التحميل
+"""
+
+# تعليمات النظام للنماذج النصية (system_instruction) - لا تُكرر داخل كل طلب
+SYSTEM_INSTRUCTION = """أنت مساعد ذكي يتحدث العربية. أجب بطريقة مفيدة ومهذبة.
+إذا كان السؤال بالإنجليزية، يمكنك الإجابة بالإنجليزية.
+إذا كان السؤال بالعربية، أجب بالعربية.
+كن دقيقاً ومفيداً في إجاباتك."""
+
+# تعليمات النظام لنموذج الصور
+IMAGE_SYSTEM_INSTRUCTION = """أنت محلل صور ذكي. صف الصورة بالتفصيل باللغة العربية.
+اذكر الأشياء المرئية، الألوان، الأشخاص، الأماكن، والأنشطة.
+كن دقيقاً ومفيداً في وصفك."""
+
+DEFAULT_IMAGE_PROMPT = "صف هذه الصورة بالتفصيل باللغة العربية"
+
+CONTEXT_PROMPT = "السياق: {context}\n\nالسؤال: {prompt}"
+
+SUMMARIZE_PROMPT = """قم بتلخيص النص التالي بطريقة واضحة ومفيدة:
+
+النص:
+{text}
+
+قدم تلخيصاً شاملاً يغطي النقاط الرئيسية."""
+
+SUMMARIZE_CHUNK_PROMPT = """هذا الجزء {index} من {total} من نص طويل. لخص أهم ما فيه بإيجاز دون مقدمات:
+
+{text}"""
+
+SUMMARIZE_COMBINE_PROMPT = """فيما يلي ملخصات لأجزاء متتالية من نص واحد طويل. ادمجها في تلخيص واحد واضح ومترابط يغطي النقاط الرئيسية دون تكرار:
+
+{text}"""
+
+TRANSLATE_PROMPT = """قم بترجمة النص التالي إلى {language}:
+
+النص:
+{text}
+
+قدم الترجمة بدقة مع مراعاة المعنى والسياق."""
+
+TRANSLATE_BATCH_PROMPT = """ترجم النص التالي إلى كل اللغات المذكورة بدقة مع مراعاة المعنى والسياق.
+أرجع كائن JSON فقط، مفاتيحه رموز اللغات وقيمه الترجمات:
+{languages}
+
+النص:
+{text}"""
+
+ANSWER_CONTEXT_PROMPT = """بناءً على السياق التالي، أجب على السؤال:
+
+السياق: {context}
+
+السؤال: {question}
+
+قدم إجابة شاملة ومفيدة."""
+
+ANSWER_PROMPT = "أجب على السؤال التالي بطريقة مفيدة وشاملة: {question}"
+
+CHAT_NAMED_PROMPT = """أنت تتحدث مع {user_name}.
+
+{history}رسالة المستخدم: {message}
+
+أجب بطريقة ودية ومفيدة."""
+
+CHAT_PROMPT = "{history}أجب على الرسالة التالية بطريقة ودية ومفيدة: {message}"
+
+MEMORY_SUMMARY_PROMPT = """لخص المحادثة التالية في بضع جمل قصيرة، مع الحفاظ على المعلومات المهمة عن المستخدم وطلباته:
+
+{previous}{transcript}"""
@@ -0,0 +1,390 @@
+"""
+التحكم في طلبات الذكاء الاصطناعي - طابور قبول محدود، إعادة محاولة، قاطع دائرة، دمج وطلبات احتياطية
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+class GeminiError(Exception):
+    """خطأ في طلب Gemini يجب أن يصل للمستخدم برسالة مناسبة"""
+    
+    # مفتاح رسالة الخطأ في BotHandlers.handle_error
+    reason = "processing"
+
+class GeminiOverloadedError(GeminiError):
+    """الطلب رُفض لأن الطابور ممتلئ أو انتهت مهلة الانتظار"""
+    
+    reason = "busy"
+
+class GeminiInputTooLargeError(GeminiError):
+    """النص أكبر من الحد المسموح للطلب"""
+    
+    reason = "too_long"
+
+class AdmissionController:
+    """قبول الطلبات حتى حد التزامن، وانتظار الباقي في طابور محدود بمهلة"""
+    
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 50, queue_timeout: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    async def acquire(self):
+        """حجز خانة أو رفع GeminiOverloadedError"""
+        started = time.monotonic()
+        if not self._semaphore.locked():
+            # خانة متاحة ولا أحد ينتظر - قبول فوري
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise GeminiOverloadedError("طابور الطلبات ممتلئ")
+            
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise GeminiOverloadedError("انتهت مهلة انتظار الطلب")
+            finally:
+                self.waiting -= 1
+        
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.admitted += 1
+        self.in_flight += 1
+    
+    async def try_acquire(self) -> bool:
+        """حجز خانة فقط إذا كانت متاحة الآن ولا أحد ينتظر - دون انتظار"""
+        if self._semaphore.locked() or self.waiting:
+            return False
+        # الخانة متاحة فلا يتوقف acquire هنا
+        await self._semaphore.acquire()
+        self.admitted += 1
+        self.in_flight += 1
+        return True
+    
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+    
+    @asynccontextmanager
+    async def slot(self):
+        """async with controller.slot(): ..."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+    
+    def stats(self) -> Dict:
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'waiting': self.waiting,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'avg_wait': round(self.total_wait / self.admitted, 3) if self.admitted else 0,
+            'max_wait': round(self.max_wait, 3)
+        }
+
+class GeminiUnavailableError(GeminiError):
+    """الخدمة متعطلة: قاطع الدائرة مفتوح أو فشلت كل المحاولات"""
+    
+    reason = "unavailable"
+
+# أخطاء مؤقتة تستحق إعادة المحاولة (429، 5xx، انتهاء المهلة)
+TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+def is_transient_error(error: Exception) -> bool:
+    """هل الخطأ مؤقت ويستحق إعادة المحاولة"""
+    return isinstance(error, TRANSIENT_ERRORS)
+
+class CircuitBreaker:
+    """قاطع دائرة: يفتح بعد أخطاء مؤقتة متتالية ويرفض الطلبات فوراً حتى انتهاء فترة التهدئة"""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.short_circuited = 0
+        self._probing = False
+    
+    def before_call(self):
+        """السماح بالطلب أو رفع GeminiUnavailableError"""
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            # انتهت التهدئة - طلب تجريبي واحد
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.short_circuited += 1
+        raise GeminiUnavailableError("خدمة Gemini متعطلة مؤقتاً")
+    
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ عادت خدمة Gemini - إغلاق قاطع الدائرة")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+    
+    def abandon(self):
+        """الطلب أُلغي قبل معرفة النتيجة - السماح بطلب تجريبي آخر"""
+        self._probing = False
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.warning(f"⚠️ فتح قاطع الدائرة لمدة {self.cooldown} ثانية بعد {self.failures} أخطاء")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+    
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'short_circuited': self.short_circuited
+        }
+
+class RetryPolicy:
+    """إعادة المحاولة للأخطاء المؤقتة بتأخير أسي عشوائي ضمن مهلة كلية للطلب"""
+    
+    def __init__(self, breaker: CircuitBreaker, max_attempts: int = 4, base_delay: float = 0.5,
+                 max_delay: float = 8.0, deadline: float = 30.0):
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retries = 0
+        self.exhausted = 0
+    
+    async def call(self, factory: Callable[[], Awaitable]):
+        """تنفيذ factory() مع إعادة المحاولة - كل محاولة تنشئ coroutine جديدة"""
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(factory(), remaining)
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                if not is_transient_error(e):
+                    # خطأ دائم (طلب غير صالح مثلاً) - الخدمة نفسها تعمل
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                attempt += 1
+                
+                # تأخير أسي مع عشوائية كاملة حتى لا تتزامن المحاولات
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    self.exhausted += 1
+                    logger.warning(f"فشل طلب Gemini بعد {attempt} محاولات: {e}")
+                    raise GeminiUnavailableError(str(e)) from e
+                
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            
+            self.breaker.record_success()
+            return result
+    
+    def stats(self) -> Dict:
+        return {'retries': self.retries, 'exhausted': self.exhausted}
+
+class _Flight:
+    """طلب جارٍ واحد وعدد المنتظرين عليه"""
+    
+    __slots__ = ('task', 'waiters')
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """دمج الطلبات المتطابقة المتزامنة في طلب واحد يشترك الجميع في نتيجته"""
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.shared = 0
+    
+    def _forget(self, key: str, task: asyncio.Task):
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is task:
+            del self._flights[key]
+    
+    async def do(self, key: str, factory: Callable[[], Awaitable]):
+        """تنفيذ factory() مرة واحدة لكل مفتاح جارٍ"""
+        flight = self._flights.get(key)
+        if flight is None:
+            # الطلب في مهمة مستقلة حتى لا يلغيه انسحاب أول منتظر
+            task = asyncio.ensure_future(factory())
+            flight = self._flights[key] = _Flight(task)
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.shared += 1
+        
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # انسحب كل المنتظرين - لا داعي لإكمال الطلب
+                flight.task.cancel()
+                self._forget(key, flight.task)
+    
+    def stats(self) -> Dict:
+        return {'in_flight': len(self._flights), 'leaders': self.leaders, 'shared': self.shared}
+
+class Hedger:
+    """طلبات احتياطية: إذا تأخر الطلب عن نسبة مئوية من زمن الاستجابة المقاس يُرسل طلب ثانٍ ويؤخذ الأسرع
+    
+    زمن الاستجابة يُقاس لكل مفتاح (العملية والنموذج) على حدة، فلا يؤخر التلخيص الطويل احتياط الدردشة القصيرة.
+    مع طابور القبول يحجز كل طلب خانته، والطلب الاحتياطي لا يُرسل إلا إذا توفرت خانة فوراً
+    """
+    
+    def __init__(self, percentile: float = 95, budget: float = 0.05, min_samples: int = 20, window: int = 500,
+                 admission: AdmissionController = None):
+        self.percentile = percentile
+        self.budget = budget  # الحد الأقصى لنسبة الطلبات الاحتياطية
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies: Dict[str, deque] = {}
+        self.admission = admission
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped = 0  # طلبات احتياطية لم تُرسل لامتلاء الخانات
+    
+    def _window(self, key: str) -> deque:
+        window = self.latencies.get(key)
+        if window is None:
+            window = self.latencies[key] = deque(maxlen=self.window)
+        return window
+    
+    def hedge_delay(self, key: str = '*') -> Optional[float]:
+        """زمن الانتظار قبل الطلب الاحتياطي لهذا المفتاح، أو None إذا لم تكفِ العينات"""
+        latencies = self.latencies.get(key)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+    
+    async def _admitted(self, factory: Callable[[], Awaitable]):
+        async with self.admission.slot():
+            return await factory()
+    
+    async def _reserved(self, factory: Callable[[], Awaitable]):
+        """تنفيذ الطلب الاحتياطي في خانة محجوزة مسبقاً"""
+        try:
+            return await factory()
+        finally:
+            self.admission.release()
+    
+    async def call(self, factory: Callable[[], Awaitable], key: str = '*'):
+        """تنفيذ factory() مع طلب احتياطي واحد عند التأخر عن المعتاد لهذا المفتاح"""
+        self.requests += 1
+        latencies = self._window(key)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._admitted(factory) if self.admission else factory())
+        pending = {primary}
+        try:
+            delay = self.hedge_delay(key)
+            if delay is not None and self.hedges < self.budget * self.requests:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.admission and not await self.admission.try_acquire():
+                    # الخدمة مشغولة بالكامل - الطلب الاحتياطي يزيد الضغط ولا يسرّع شيئاً
+                    self.skipped += 1
+                elif not done:
+                    self.hedges += 1
+                    hedge_started = time.monotonic()
+                    hedge = asyncio.ensure_future(self._reserved(factory) if self.admission else factory())
+                    pending.add(hedge)
+                    
+                    error = None
+                    while pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            if task.exception() is None:
+                                if task is hedge:
+                                    self.hedge_wins += 1
+                                    latencies.append(time.monotonic() - hedge_started)
+                                else:
+                                    latencies.append(time.monotonic() - started)
+                                return task.result()
+                            error = error or task.exception()
+                    raise error
+            
+            result = await primary
+            latencies.append(time.monotonic() - started)
+            return result
+        finally:
+            # إلغاء الطلب الخاسر أو كل الطلبات إذا أُلغي المستدعي
+            for task in pending:
+                task.cancel()
+    
+    def stats(self) -> Dict:
+        delays = {}
+        for key in sorted(self.latencies):
+            delay = self.hedge_delay(key)
+            if delay is not None:
+                delays[key] = round(delay, 3)
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'skipped': self.skipped,
+            'hedge_delays': delays
+        }
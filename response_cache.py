@@ -0,0 +1,192 @@
+"""
+ذاكرة مؤقتة لردود الذكاء الاصطناعي - LRU بحجم محدود وصلاحية لكل عملية
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def normalize_prompt(prompt: str) -> str:
+    """توحيد المسافات حتى لا تختلف المفاتيح لنفس النص"""
+    return ' '.join(prompt.split())
+
+def make_cache_key(prompt: str, model_name: str, generation_config: Dict) -> str:
+    """مفتاح ثابت من النص الموحد واسم النموذج وإعدادات التوليد"""
+    payload = json.dumps(
+        [normalize_prompt(prompt), model_name, generation_config],
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def make_content_key(operation: str, text: str, model_name: str, language: str = None) -> str:
+    """مفتاح محتوى للعمليات الثابتة: العملية والنص واللغة الهدف والنموذج"""
+    payload = json.dumps(
+        [operation, normalize_prompt(text), language, model_name],
+        ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """ذاكرة LRU مع صلاحية لكل عنصر"""
+    
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str) -> Optional[str]:
+        """قراءة عنصر صالح ونقله لآخر القائمة"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: str, value: str, ttl: float):
+        """حفظ عنصر وإخراج الأقدم استخداماً عند امتلاء الذاكرة"""
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits * 100 / lookups, 1) if lookups else 0
+        }
+
+class PersistentCache:
+    """ذاكرة دائمة على القرص (SQLite) للترجمة والتلخيص تبقى بعد إعادة التشغيل"""
+    
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            last_access REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)",
+    )
+    
+    # نسبة الحجم المستهدفة بعد الإخراج حتى لا يتكرر مع كل كتابة
+    EVICT_TARGET = 0.9
+    
+    def __init__(self, db_path: str = "response_cache.db", max_bytes: int = 100 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    
+    def get(self, key: str) -> Optional[str]:
+        """قراءة عنصر وتحديث وقت آخر استخدام"""
+        try:
+            with self._lock:
+                row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+            self.hits += 1
+            return row[0]
+        except Exception as e:
+            logger.error(f"خطأ في قراءة الذاكرة الدائمة: {e}")
+            return None
+    
+    def set(self, key: str, value: str):
+        """حفظ عنصر وإخراج الأقدم استخداماً إذا تجاوز الحجم الحد"""
+        size = len(key) + len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now)
+                )
+                self.total_bytes += size - (old[0] if old else 0)
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+                self.conn.commit()
+        except Exception as e:
+            logger.error(f"خطأ في الكتابة في الذاكرة الدائمة: {e}")
+    
+    def _evict(self):
+        """حذف الأقدم استخداماً حتى الحجم المستهدف - يُستدعى مع القفل"""
+        target = self.max_bytes * self.EVICT_TARGET
+        victims = []
+        cursor = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access")
+        for key, size in cursor:
+            if self.total_bytes <= target:
+                break
+            victims.append((key,))
+            self.total_bytes -= size
+        cursor.close()
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+    
+    async def get_async(self, key: str) -> Optional[str]:
+        """قراءة دون حجب حلقة الأحداث"""
+        return await asyncio.to_thread(self.get, key)
+    
+    async def set_async(self, key: str, value: str):
+        """كتابة دون حجب حلقة الأحداث"""
+        await asyncio.to_thread(self.set, key, value)
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'size_bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits * 100 / lookups, 1) if lookups else 0
+        }
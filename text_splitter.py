@@ -0,0 +1,60 @@
+"""
+تقسيم النصوص الطويلة إلى أجزاء عند حدود الفقرات والجمل
+"""
+
+import re
+from typing import List
+
+# نهاية الجملة: نقطة أو علامة استفهام/تعجب (ومنها علامة الاستفهام العربية) يليها فراغ
+SENTENCE_END = re.compile(r'(?<=[.!?؟…])\s+')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+def split_sentences(text: str) -> List[str]:
+    """تقسيم فقرة إلى جمل"""
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+def _hard_split(text: str, max_chars: int) -> List[str]:
+    """تقسيم جملة أطول من الحد عند آخر فراغ قبل الحد"""
+    parts = []
+    while len(text) > max_chars:
+        cut = text.rfind(' ', 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        parts.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        parts.append(text)
+    return parts
+
+def _pack(pieces: List[str], max_chars: int, separator: str) -> List[str]:
+    """جمع القطع المتتالية في أجزاء لا تتجاوز الحد"""
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """تقسيم النص إلى أجزاء حتى max_chars - الفقرات أولاً، ثم الجمل للفقرات الطويلة"""
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        
+        # فقرة طويلة: تُقسم إلى جمل، والجملة الأطول من الحد تُقطع عند الفراغات
+        sentences = []
+        for sentence in split_sentences(paragraph):
+            sentences.extend(_hard_split(sentence, max_chars))
+        pieces.extend(_pack(sentences, max_chars, ' '))
+    
+    return _pack(pieces, max_chars, '\n\n')
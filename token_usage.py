@@ -0,0 +1,76 @@
+"""
+محاسبة رموز Gemini - تقدير حجم الطلب وتسجيل الاستهلاك لكل عملية ولكل مستخدم
+"""
+
+import heapq
+from typing import Dict, List
+
+# تقدير محافظ: النص العربي يستهلك رموزاً أكثر لكل حرف من الإنجليزي
+CHARS_PER_TOKEN = 3
+
+def estimate_tokens(text: str) -> int:
+    """تقدير سريع لعدد الرموز دون طلب للخادم"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class UsageCounter:
+    """مجموع الطلبات والرموز"""
+    
+    __slots__ = ('requests', 'input_tokens', 'output_tokens')
+    
+    def __init__(self):
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+    
+    def add(self, input_tokens: int, output_tokens: int):
+        self.requests += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+    
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+    
+    def to_dict(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens
+        }
+
+class TokenUsage:
+    """استهلاك الرموز لكل عملية ولكل مستخدم"""
+    
+    def __init__(self):
+        self.by_operation: Dict[str, UsageCounter] = {}
+        self.by_user: Dict[int, UsageCounter] = {}
+        self.rejected = 0
+    
+    def record(self, operation: str, user_id: int, usage_metadata):
+        """تسجيل استهلاك طلب من usage_metadata في رد Gemini"""
+        if usage_metadata is None:
+            return
+        input_tokens = getattr(usage_metadata, 'prompt_token_count', 0) or 0
+        output_tokens = getattr(usage_metadata, 'candidates_token_count', 0) or 0
+        
+        operation = operation or 'other'
+        if operation not in self.by_operation:
+            self.by_operation[operation] = UsageCounter()
+        self.by_operation[operation].add(input_tokens, output_tokens)
+        
+        if user_id is not None:
+            if user_id not in self.by_user:
+                self.by_user[user_id] = UsageCounter()
+            self.by_user[user_id].add(input_tokens, output_tokens)
+    
+    def top_users(self, count: int = 5) -> List[Dict]:
+        """أكثر المستخدمين استهلاكاً"""
+        top = heapq.nlargest(count, self.by_user.items(), key=lambda item: item[1].total_tokens)
+        return [{'user_id': user_id, **counter.to_dict()} for user_id, counter in top]
+    
+    def stats(self) -> Dict:
+        return {
+            'operations': {operation: counter.to_dict() for operation, counter in self.by_operation.items()},
+            'top_users': self.top_users(),
+            'rejected': self.rejected
+        }
@@ -0,0 +1,68 @@
+"""
+معالجة التحديثات بالتوازي بين المحادثات مع الحفاظ على الترتيب داخل كل محادثة
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """تحديثات المحادثات المختلفة تعمل بالتوازي، وتحديثات المحادثة الواحدة بالترتيب"""
+    
+    # التحديثات المنتظرة (بما فيها المنتظرة خلف قفل محادثتها) لكل عامل
+    PENDING_PER_WORKER = 8
+    
+    def __init__(self, max_concurrent_updates: int):
+        # حد الأساس يشمل المنتظرين خلف أقفال المحادثات حتى لا تحجز محادثة مزدحمة كل الخانات
+        super().__init__(max_concurrent_updates * self.PENDING_PER_WORKER)
+        self.workers = max_concurrent_updates
+        self._worker_slots: Optional[asyncio.Semaphore] = None
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+    
+    @staticmethod
+    def chat_key(update: object) -> Optional[int]:
+        """مفتاح الترتيب: المحادثة، أو المستخدم إن لم توجد محادثة"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+    
+    async def initialize(self):
+        self._worker_slots = asyncio.Semaphore(self.workers)
+    
+    async def shutdown(self):
+        pass
+    
+    async def _run(self, coroutine: Awaitable):
+        async with self._worker_slots:
+            await coroutine
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        """تشغيل التحديث بعد انتهاء التحديثات السابقة من نفس المحادثة"""
+        key = self.chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        
+        # asyncio.Lock يوقظ المنتظرين بترتيب وصولهم
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._chat_waiters[key] -= 1
+            if not self._chat_waiters[key]:
+                # إزالة أقفال المحادثات الخاملة حتى لا تنمو الذاكرة مع عدد المحادثات
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
@@ -0,0 +1,146 @@
+"""
+إحصائيات النشاط - عدادات تراكمية في حلقات زمنية ثابتة الحجم
+"""
+
+import logging
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+class RollingCounter:
+    """عدادات نشاط لكل فترة زمنية في حلقة ثابتة الحجم"""
+    
+    def __init__(self, bucket_seconds: int, size: int):
+        self.bucket_seconds = bucket_seconds
+        self.size = size
+        self.buckets = array('q', [-1] * size)  # رقم الفترة المخزنة في كل خانة
+        self.messages = array('L', [0] * size)
+        self.active_users = array('L', [0] * size)
+        self.new_users = array('L', [0] * size)
+        self._current = -1
+        self._seen = set()  # المستخدمون النشطون في الفترة الحالية فقط
+    
+    def _slot(self, now: float) -> int:
+        """خانة الفترة الحالية، مع تصفيرها إذا كانت تحمل فترة قديمة"""
+        bucket = int(now // self.bucket_seconds)
+        index = bucket % self.size
+        if self.buckets[index] != bucket:
+            self.buckets[index] = bucket
+            self.messages[index] = 0
+            self.active_users[index] = 0
+            self.new_users[index] = 0
+        if bucket != self._current:
+            self._current = bucket
+            self._seen.clear()
+        return index
+    
+    def record_message(self, user_id: int, now: float):
+        """تسجيل رسالة ومستخدم نشط"""
+        index = self._slot(now)
+        self.messages[index] += 1
+        if user_id not in self._seen:
+            self._seen.add(user_id)
+            self.active_users[index] += 1
+    
+    def record_new_users(self, count: int, now: float):
+        """تسجيل مستخدمين جدد"""
+        index = self._slot(now)
+        self.new_users[index] += count
+    
+    def series(self, count: int, now: float = None) -> List[Dict]:
+        """آخر عدد من الفترات من الأقدم للأحدث"""
+        now = time.time() if now is None else now
+        current = int(now // self.bucket_seconds)
+        result = []
+        for bucket in range(current - min(count, self.size) + 1, current + 1):
+            index = bucket % self.size
+            fresh = self.buckets[index] == bucket
+            result.append({
+                'start': datetime.fromtimestamp(bucket * self.bucket_seconds, timezone.utc),
+                'messages': self.messages[index] if fresh else 0,
+                'active_users': self.active_users[index] if fresh else 0,
+                'new_users': self.new_users[index] if fresh else 0
+            })
+        return result
+    
+    def to_dict(self) -> Dict:
+        return {
+            'buckets': self.buckets.tolist(),
+            'messages': self.messages.tolist(),
+            'active_users': self.active_users.tolist(),
+            'new_users': self.new_users.tolist()
+        }
+    
+    def load_dict(self, data: Dict):
+        if len(data.get('buckets', [])) != self.size:
+            return
+        self.buckets = array('q', data['buckets'])
+        self.messages = array('L', data['messages'])
+        self.active_users = array('L', data['active_users'])
+        self.new_users = array('L', data['new_users'])
+
+class ActivityRollups:
+    """تجميعات النشاط لكل ساعة ولكل يوم"""
+    
+    def __init__(self, stats_file: str = "stats.json", hours: int = 48, days: int = 30):
+        self.stats_file = stats_file
+        self._save_lock = threading.Lock()
+        self.hourly = RollingCounter(3600, hours)
+        self.daily = RollingCounter(86400, days)
+        self.load()
+    
+    def record_message(self, user_id: int, now: float = None):
+        """تسجيل رسالة في كل التجميعات - O(1)"""
+        now = time.time() if now is None else now
+        self.hourly.record_message(user_id, now)
+        self.daily.record_message(user_id, now)
+    
+    def record_new_users(self, count: int, now: float = None):
+        """تسجيل مستخدمين جدد في كل التجميعات"""
+        if not count:
+            return
+        now = time.time() if now is None else now
+        self.hourly.record_new_users(count, now)
+        self.daily.record_new_users(count, now)
+    
+    def load(self):
+        """تحميل التجميعات المحفوظة (النشطون في الفترة الحالية قد يُعدّون مرتين بعد إعادة التشغيل)"""
+        try:
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.hourly.load_dict(data.get('hourly', {}))
+                self.daily.load_dict(data.get('daily', {}))
+        except Exception as e:
+            logger.error(f"خطأ في تحميل الإحصائيات: {e}")
+    
+    def snapshot(self) -> Dict:
+        """نسخة قابلة للحفظ - تؤخذ داخل حلقة الأحداث"""
+        return {'hourly': self.hourly.to_dict(), 'daily': self.daily.to_dict()}
+    
+    def save(self, snapshot: Dict) -> bool:
+        """حفظ نسخة التجميعات - يمكن استدعاؤها من خيط منفصل، والحفظ المتزامن يتم بالتتابع"""
+        tmp_file = None
+        try:
+            with self._save_lock:
+                # ملف مؤقت فريد في نفس المجلد حتى يبقى os.replace ذرياً
+                fd, tmp_file = tempfile.mkstemp(
+                    prefix=f"{os.path.basename(self.stats_file)}.", suffix=".tmp",
+                    dir=os.path.dirname(os.path.abspath(self.stats_file))
+                )
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, separators=(',', ':'))
+                os.replace(tmp_file, self.stats_file)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حفظ الإحصائيات: {e}")
+            if tmp_file and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return False
@@ -0,0 +1,579 @@
+"""
+تخزين بيانات المستخدمين - واجهات قابلة للاستبدال
+"""
+
+import logging
+import bisect
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+class PendingUpdate:
+    """تحديثات مستخدم واحد المدمجة بانتظار الحفظ"""
+    
+    __slots__ = ('user_id', 'username', 'first_name', 'first_seen', 'last_seen', 'count')
+    
+    def __init__(self, user_id: int, username: str, first_name: str, timestamp: str):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.count = 1
+    
+    def merge(self, username: str, first_name: str, timestamp: str):
+        """دمج تفاعل جديد لنفس المستخدم"""
+        self.last_seen = timestamp
+        self.count += 1
+        if username:
+            self.username = username
+        if first_name:
+            self.first_name = first_name
+    
+    def absorb(self, newer: 'PendingUpdate'):
+        """دمج تحديث أحدث مدمج بدوره"""
+        self.last_seen = newer.last_seen
+        self.count += newer.count
+        if newer.username:
+            self.username = newer.username
+        if newer.first_name:
+            self.first_name = newer.first_name
+
+def to_epoch(value: Union[str, int, float]) -> int:
+    """تحويل طابع زمني ISO أو رقمي إلى ثوانٍ صحيحة"""
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return int(value)
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+class UserRecord:
+    """سجل مستخدم مضغوط في الذاكرة: خانات ثابتة وطوابع زمنية صحيحة وأسماء مشتركة"""
+    
+    __slots__ = ('user_id', 'username', 'first_name', 'join_date', 'last_interaction',
+                 'message_count', 'is_active')
+    
+    # ترتيب الأعمدة في اللقطة المحفوظة
+    FIELDS = __slots__
+    
+    def __init__(self, user_id: int, username: Optional[str], first_name: Optional[str],
+                 join_date: int, last_interaction: int, message_count: int = 1, is_active: bool = True):
+        self.user_id = user_id
+        self.username = _intern(username)
+        self.first_name = _intern(first_name)
+        self.join_date = join_date
+        self.last_interaction = last_interaction
+        self.message_count = message_count
+        self.is_active = is_active
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'UserRecord':
+        """إنشاء سجل من صيغة القاموس القديمة"""
+        return cls(
+            int(data['user_id']), data.get('username'), data.get('first_name'),
+            to_epoch(data['join_date']), to_epoch(data['last_interaction']),
+            data.get('message_count', 0), bool(data.get('is_active', True))
+        )
+    
+    def to_dict(self) -> Dict:
+        """صيغة القاموس المعتادة لبقية الكود"""
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'join_date': datetime.fromtimestamp(self.join_date).isoformat(),
+            'last_interaction': datetime.fromtimestamp(self.last_interaction).isoformat(),
+            'message_count': self.message_count,
+            'is_active': self.is_active
+        }
+    
+    def to_row(self) -> list:
+        return [getattr(self, field) for field in self.FIELDS]
+
+class UserStore:
+    """الواجهة المشتركة لمخازن المستخدمين"""
+    
+    def apply_updates(self, updates: List[PendingUpdate]) -> Dict:
+        """حفظ دفعة تحديثات مدمجة وإعادة تنشيط أصحابها
+        
+        يعيد {'new_users': معرفات المستخدمين الجدد, 'reactivated': عدد من عادوا للنشاط}
+        """
+        raise NotImplementedError
+    
+    def set_inactive(self, user_ids: List[int]) -> int:
+        """تعليم مستخدمين كغير نشطين، يعيد عدد من تغيرت حالتهم"""
+        raise NotImplementedError
+    
+    def record_interaction(self, user_id: int, username: str, first_name: str, timestamp: str) -> bool:
+        """تسجيل تفاعل مستخدم، يعيد True إذا كان المستخدم جديداً"""
+        return bool(self.apply_updates([PendingUpdate(user_id, username, first_name, timestamp)])['new_users'])
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """الحصول على سجل مستخدم واحد"""
+        raise NotImplementedError
+    
+    def count_users(self, active_only: bool = False) -> int:
+        """عدد المستخدمين"""
+        raise NotImplementedError
+    
+    def get_totals(self) -> Dict:
+        """إجمالي المستخدمين والنشطين منهم والرسائل"""
+        raise NotImplementedError
+    
+    def iter_users(self, batch_size: int = 1000, after_id: int = None, active_only: bool = False) -> Iterator[Dict]:
+        """المرور على المستخدمين مرتبين حسب المعرف، بدءاً بعد after_id إن وُجد"""
+        raise NotImplementedError
+    
+    def get_user_ids(self, after_id: int = None, limit: int = 1000, active_only: bool = False) -> List[int]:
+        """صفحة من معرفات المستخدمين مرتبة بعد after_id - تُستدعى من خيط منفصل"""
+        raise NotImplementedError
+    
+    def close(self):
+        """إغلاق المخزن"""
+
+class JournalUserStore(UserStore):
+    """مخزن في الذاكرة بسجلات مضغوطة - لقطة دورية + سجل إلحاقي"""
+    
+    # أقل عدد من الأحداث في السجل قبل ضغطه في لقطة جديدة
+    MIN_COMPACT_ENTRIES = 1000
+    
+    def __init__(self, users_file: str = "users.json", journal_file: str = None):
+        self.users_file = users_file
+        self.journal_file = journal_file or f"{os.path.splitext(users_file)[0]}.journal"
+        self.seq = 0  # رقم آخر حدث مطبق
+        self.journal_entries = 0  # عدد الأحداث منذ آخر لقطة
+        self._journal = None
+        self._lock = threading.Lock()
+        self._sorted_ids = None  # المعرفات مرتبة - تُبنى عند أول حاجة وتُحدّث مع المستخدمين الجدد
+        self.users_data = self.load_users()
+    
+    def load_users(self) -> Dict[int, UserRecord]:
+        """تحميل بيانات المستخدمين: اللقطة ثم إعادة تطبيق السجل"""
+        users = {}
+        try:
+            if os.path.exists(self.users_file):
+                with open(self.users_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if 'rows' in data:
+                    # لقطة بصفوف مضغوطة
+                    fields = data.get('fields', UserRecord.FIELDS)
+                    for row in data['rows']:
+                        record = UserRecord(**dict(zip(fields, row)))
+                        users[record.user_id] = record
+                    self.seq = data['seq']
+                else:
+                    if isinstance(data.get('users'), dict) and 'seq' in data:
+                        legacy = data['users']
+                        self.seq = data['seq']
+                    else:
+                        # الصيغة القديمة: قاموس المستخدمين مباشرة
+                        legacy = data
+                    for user in legacy.values():
+                        record = UserRecord.from_dict(user)
+                        users[record.user_id] = record
+        except Exception as e:
+            logger.error(f"خطأ في تحميل المستخدمين: {e}")
+        
+        self.journal_entries = self._replay_journal(users)
+        return users
+    
+    def _replay_journal(self, users: Dict) -> int:
+        """إعادة تطبيق أحداث السجل الأحدث من اللقطة"""
+        replayed = 0
+        if not os.path.exists(self.journal_file):
+            return replayed
+        
+        try:
+            complete = 0  # نهاية آخر سطر مكتمل
+            torn = False
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # سطر مقطوع بسبب توقف مفاجئ أثناء الكتابة
+                        torn = not line.endswith(b'\n')
+                        if not torn:
+                            complete += len(line)
+                        continue
+                    complete += len(line)
+                    if event.get('seq', 0) > self.seq:
+                        self._apply_event(users, event)
+                        self.seq = event['seq']
+                        replayed += 1
+            
+            # الإلحاق بعد سطر ناقص يدمج الحدث التالي معه فيضيع الاثنان عند إعادة التطبيق
+            if torn:
+                with open(self.journal_file, 'r+b') as f:
+                    f.truncate(complete)
+                logger.warning(f"حُذف سطر مقطوع من نهاية سجل المستخدمين عند {complete} بايت")
+            elif complete and not line.endswith(b'\n'):
+                # آخر حدث كامل لكن بلا نهاية سطر
+                with open(self.journal_file, 'ab') as f:
+                    f.write(b'\n')
+        except Exception as e:
+            logger.error(f"خطأ في قراءة سجل المستخدمين: {e}")
+        
+        if replayed:
+            logger.info(f"تمت إعادة تطبيق {replayed} حدث من سجل المستخدمين")
+        return replayed
+    
+    def _apply_event(self, users: Dict[int, UserRecord], event: Dict) -> bool:
+        """تطبيق حدث على بيانات المستخدمين، يعيد True للمستخدم الجديد"""
+        user_id = int(event['id'])
+        user = users.get(user_id)
+        if event.get('op') == 'inactive':
+            if user is not None:
+                user.is_active = False
+            return False
+        
+        last_interaction = to_epoch(event['ts'])
+        if user is None:
+            users[user_id] = UserRecord(
+                user_id, event.get('u'), event.get('f'),
+                to_epoch(event['j']) if 'j' in event else last_interaction,
+                last_interaction, event.get('n', 1)
+            )
+            return True
+        
+        # تحديث آخر تفاعل - أي تفاعل يعيد تنشيط المستخدم
+        user.last_interaction = last_interaction
+        user.message_count += event.get('n', 1)
+        user.is_active = True
+        if event.get('u'):
+            user.username = _intern(event['u'])
+        if event.get('f'):
+            user.first_name = _intern(event['f'])
+        return False
+    
+    def _append_journal(self, events: List[Dict]):
+        """إلحاق أحداث بالسجل - تكلفة لا تعتمد على عدد المستخدمين"""
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal.write(''.join(
+            json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n' for event in events
+        ))
+        self._journal.flush()
+        self.journal_entries += len(events)
+        
+        # الضغط عندما يتجاوز السجل حجم اللقطة نفسها، فتبقى التكلفة ثابتة بالمتوسط
+        if self.journal_entries >= max(self.MIN_COMPACT_ENTRIES, len(self.users_data)):
+            self.save_users()
+    
+    def save_users(self) -> bool:
+        """حفظ لقطة كاملة لبيانات المستخدمين وتفريغ السجل"""
+        try:
+            tmp_file = f"{self.users_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                # كتابة الصفوف تباعاً بدل بناء نسخة كاملة من البيانات في الذاكرة
+                header = json.dumps({'seq': self.seq, 'fields': UserRecord.FIELDS}, separators=(',', ':'))
+                f.write(header[:-1] + ',"rows":[')
+                for index, record in enumerate(self.users_data.values()):
+                    if index:
+                        f.write(',')
+                    f.write(json.dumps(record.to_row(), ensure_ascii=False, separators=(',', ':')))
+                f.write(']}')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.users_file)
+            
+            # اللقطة تحمل رقم آخر حدث، فأي أحداث متبقية في السجل ستُتجاهل عند التحميل
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = open(self.journal_file, 'w', encoding='utf-8')
+            self.journal_entries = 0
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حفظ المستخدمين: {e}")
+            return False
+    
+    def apply_updates(self, updates: List[PendingUpdate]) -> Dict:
+        """تطبيق دفعة تحديثات في الذاكرة وإلحاقها بالسجل دفعة واحدة"""
+        new_users = []
+        reactivated = 0
+        events = []
+        with self._lock:
+            for update in updates:
+                record = self.users_data.get(update.user_id)
+                if record is not None and not record.is_active:
+                    reactivated += 1
+                self.seq += 1
+                event = {
+                    'seq': self.seq,
+                    'id': update.user_id,
+                    'ts': update.last_seen,
+                    'j': update.first_seen,
+                    'n': update.count,
+                    'u': update.username,
+                    'f': update.first_name
+                }
+                if self._apply_event(self.users_data, event):
+                    new_users.append(update.user_id)
+                events.append(event)
+            if self._sorted_ids is not None:
+                for user_id in new_users:
+                    bisect.insort(self._sorted_ids, user_id)
+            self._append_journal(events)
+        return {'new_users': new_users, 'reactivated': reactivated}
+    
+    def set_inactive(self, user_ids: List[int]) -> int:
+        """تعليم مستخدمين كغير نشطين وتسجيل ذلك في السجل"""
+        events = []
+        with self._lock:
+            for user_id in user_ids:
+                record = self.users_data.get(user_id)
+                if record is None or not record.is_active:
+                    continue
+                self.seq += 1
+                event = {'seq': self.seq, 'id': user_id, 'op': 'inactive'}
+                self._apply_event(self.users_data, event)
+                events.append(event)
+            if events:
+                self._append_journal(events)
+        return len(events)
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """الحصول على سجل مستخدم واحد"""
+        record = self.users_data.get(user_id)
+        return record.to_dict() if record else None
+    
+    def count_users(self, active_only: bool = False) -> int:
+        """عدد المستخدمين"""
+        if active_only:
+            with self._lock:
+                return sum(1 for record in self.users_data.values() if record.is_active)
+        return len(self.users_data)
+    
+    def get_totals(self) -> Dict:
+        """إجمالي المستخدمين والنشطين منهم والرسائل"""
+        with self._lock:
+            total_messages = sum(record.message_count for record in self.users_data.values())
+            active_users = sum(1 for record in self.users_data.values() if record.is_active)
+        return {
+            'total_users': len(self.users_data),
+            'active_users': active_users,
+            'total_messages': total_messages
+        }
+    
+    def _sorted_after(self, after_id: int = None) -> int:
+        """موضع أول معرف بعد after_id في القائمة المرتبة - يُستدعى مع القفل"""
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.users_data)
+        return 0 if after_id is None else bisect.bisect_right(self._sorted_ids, after_id)
+    
+    def iter_users(self, batch_size: int = 1000, after_id: int = None, active_only: bool = False) -> Iterator[Dict]:
+        """المرور على المستخدمين مرتبين حسب المعرف"""
+        with self._lock:
+            start = self._sorted_after(after_id)
+            user_ids = self._sorted_ids[start:]
+        for user_id in user_ids:
+            record = self.users_data.get(user_id)
+            if record is not None and (record.is_active or not active_only):
+                yield record.to_dict()
+    
+    def get_user_ids(self, after_id: int = None, limit: int = 1000, active_only: bool = False) -> List[int]:
+        """صفحة من معرفات المستخدمين مرتبة بعد after_id"""
+        page = []
+        with self._lock:
+            index = self._sorted_after(after_id)
+            while index < len(self._sorted_ids) and len(page) < limit:
+                user_id = self._sorted_ids[index]
+                if not active_only or self.users_data[user_id].is_active:
+                    page.append(user_id)
+                index += 1
+        return page
+    
+    def close(self):
+        """ضغط السجل في لقطة وإغلاقه"""
+        with self._lock:
+            if self.journal_entries:
+                self.save_users()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+class SQLiteUserStore(UserStore):
+    """مخزن SQLite بوضع WAL مع فهارس وحفظ كل دفعة في معاملة واحدة"""
+    
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            join_date TEXT NOT NULL,
+            last_interaction TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            is_active INTEGER NOT NULL DEFAULT 1
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_users_last_interaction ON users (last_interaction)",
+        "CREATE INDEX IF NOT EXISTS idx_users_is_active ON users (is_active, user_id)",
+    )
+    
+    COLUMNS = "user_id, username, first_name, join_date, last_interaction, message_count, is_active"
+    
+    # حد المتغيرات في استعلام واحد (SQLite القديمة تسمح بـ 999)
+    QUERY_CHUNK = 500
+    
+    def __init__(self, db_path: str = "users.db", legacy_users_file: str = "users.json"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+        
+        self._migrate_legacy(legacy_users_file)
+    
+    def _migrate_legacy(self, legacy_users_file: str):
+        """استيراد users.json القديم مرة واحدة إذا كانت القاعدة فارغة"""
+        if not legacy_users_file or not os.path.exists(legacy_users_file):
+            return
+        if self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return
+        
+        try:
+            legacy = JournalUserStore(legacy_users_file)
+            rows = [
+                (int(user['user_id']), user.get('username'), user.get('first_name'),
+                 user['join_date'], user['last_interaction'],
+                 user.get('message_count', 0), int(user.get('is_active', True)))
+                for user in legacy.iter_users()
+            ]
+            with self._lock:
+                self.conn.executemany(
+                    f"INSERT OR IGNORE INTO users ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self.conn.commit()
+            logger.info(f"✅ تم نقل {len(rows)} مستخدم من {legacy_users_file} إلى {self.db_path}")
+        except Exception as e:
+            logger.error(f"خطأ في نقل المستخدمين القدامى: {e}")
+    
+    def apply_updates(self, updates: List[PendingUpdate]) -> Dict:
+        """حفظ دفعة التحديثات المدمجة في معاملة واحدة"""
+        new_users = []
+        reactivated = 0
+        with self._lock:
+            for start in range(0, len(updates), self.QUERY_CHUNK):
+                chunk = [update.user_id for update in updates[start:start + self.QUERY_CHUNK]]
+                placeholders = ', '.join('?' * len(chunk))
+                existing = dict(self.conn.execute(
+                    f"SELECT user_id, is_active FROM users WHERE user_id IN ({placeholders})", chunk
+                ).fetchall())
+                new_users.extend(user_id for user_id in chunk if user_id not in existing)
+                reactivated += sum(1 for is_active in existing.values() if not is_active)
+            
+            self.conn.executemany(
+                f"""INSERT INTO users ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    last_interaction = excluded.last_interaction,
+                    message_count = message_count + excluded.message_count,
+                    is_active = 1,
+                    username = COALESCE(excluded.username, username),
+                    first_name = COALESCE(excluded.first_name, first_name)""",
+                [
+                    (update.user_id, update.username, update.first_name,
+                     update.first_seen, update.last_seen, update.count)
+                    for update in updates
+                ]
+            )
+            self.conn.commit()
+        return {'new_users': new_users, 'reactivated': reactivated}
+    
+    def set_inactive(self, user_ids: List[int]) -> int:
+        """تعليم مستخدمين كغير نشطين"""
+        changed = 0
+        with self._lock:
+            for start in range(0, len(user_ids), self.QUERY_CHUNK):
+                chunk = list(user_ids[start:start + self.QUERY_CHUNK])
+                placeholders = ', '.join('?' * len(chunk))
+                changed += self.conn.execute(
+                    f"UPDATE users SET is_active = 0 WHERE is_active = 1 AND user_id IN ({placeholders})", chunk
+                ).rowcount
+            self.conn.commit()
+        return changed
+    
+    def _row_to_user(self, row: sqlite3.Row) -> Dict:
+        user = dict(row)
+        user['is_active'] = bool(user['is_active'])
+        return user
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """الحصول على سجل مستخدم واحد"""
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return self._row_to_user(row) if row else None
+    
+    def count_users(self, active_only: bool = False) -> int:
+        """عدد المستخدمين"""
+        query = "SELECT COUNT(*) FROM users"
+        if active_only:
+            query += " WHERE is_active = 1"
+        with self._lock:
+            return self.conn.execute(query).fetchone()[0]
+    
+    def get_totals(self) -> Dict:
+        """إجمالي المستخدمين والنشطين منهم والرسائل"""
+        with self._lock:
+            total_users, active_users, total_messages = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(is_active), 0), COALESCE(SUM(message_count), 0) FROM users"
+            ).fetchone()
+        return {'total_users': total_users, 'active_users': active_users, 'total_messages': total_messages}
+    
+    def iter_users(self, batch_size: int = 1000, after_id: int = None, active_only: bool = False) -> Iterator[Dict]:
+        """المرور على المستخدمين بترقيم المفتاح عبر الفهرس، دفعة بعد دفعة"""
+        # مع active_only يُستخدم الفهرس (is_active, user_id)
+        condition = "is_active = 1 AND " if active_only else ""
+        last_id = after_id
+        while True:
+            with self._lock:
+                if last_id is None:
+                    rows = self.conn.execute(
+                        f"SELECT {self.COLUMNS} FROM users WHERE {condition}1 ORDER BY user_id LIMIT ?",
+                        (batch_size,)
+                    ).fetchall()
+                else:
+                    rows = self.conn.execute(
+                        f"SELECT {self.COLUMNS} FROM users WHERE {condition}user_id > ? ORDER BY user_id LIMIT ?",
+                        (last_id, batch_size)
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_user(row)
+            last_id = rows[-1]['user_id']
+    
+    def get_user_ids(self, after_id: int = None, limit: int = 1000, active_only: bool = False) -> List[int]:
+        """صفحة من معرفات المستخدمين عبر الفهرس بعد after_id"""
+        condition = "is_active = 1 AND " if active_only else ""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT user_id FROM users WHERE {condition}user_id > ? ORDER BY user_id LIMIT ?",
+                (after_id if after_id is not None else -2 ** 63, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def close(self):
+        """إغلاق الاتصال"""
+        with self._lock:
+            self.conn.close()
+
+def create_user_store(backend: str = "sqlite", path: str = None) -> UserStore:
+    """إنشاء مخزن المستخدمين المطلوب"""
+    if backend == "journal":
+        return JournalUserStore(path or "users.json")
+    if backend == "sqlite":
+        return SQLiteUserStore(path or "users.db")
+    raise ValueError(f"نوع مخزن المستخدمين غير معروف: {backend}")